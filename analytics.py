@@ -0,0 +1,254 @@
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from database import get_db_connection
+
+
+# Check-in latency histogram bin edges in minutes after start_time
+LATENCY_BINS = [0, 1, 2, 5, 10, 15, 30, 60, np.inf]
+
+
+def latency_labels():
+    """Display labels for the LATENCY_BINS buckets"""
+    labels = []
+    for low, high in zip(LATENCY_BINS[:-1], LATENCY_BINS[1:]):
+        labels.append(f'{low}-{high}分钟' if np.isfinite(high) else f'{low}分钟以上')
+    return labels
+
+
+def _percent(numerator, denominator):
+    """Element-wise numerator / denominator * 100, with 0 where denominator is 0"""
+    result = np.zeros(np.shape(numerator), dtype=np.float64)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result * 100
+
+
+class AttendanceTrends:
+    """Students x tasks attendance matrix with vectorized trend analytics.
+
+    The matrix is loaded once and then refreshed incrementally: new
+    check-in records are picked up by record id, and the matrix is only
+    rebuilt when students, tasks or enrollments change. A second matrix of
+    the same shape marks which tasks each student is expected to attend
+    (all tasks without a course, plus those of their enrolled courses).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._last_record_id = 0
+        self._students = []
+        self._student_ord = {}
+        self._task_ids = []
+        self._task_ord = {}
+        self._task_starts = np.array([], dtype='datetime64[s]')
+        self._task_courses = np.array([], dtype=np.int64)
+        self._course_students = {}
+        self._matrix = np.zeros((0, 0), dtype=np.uint8)
+        self._expected = np.zeros((0, 0), dtype=np.uint8)
+        self._latency_tasks = []
+        self._latency_chunks = []
+
+    def _fetch_signature(self, conn):
+        """Data versions of the student, task and enrollment sets"""
+        return tuple(row[0] for row in conn.execute(
+            "SELECT version FROM data_versions WHERE name IN ('users', 'tasks', 'courses') ORDER BY name"
+        ))
+
+    def _rebuild(self, conn, signature):
+        students = conn.execute(
+            'SELECT id, username, name FROM users WHERE role = ? ORDER BY username',
+            ('student',)
+        ).fetchall()
+        tasks = conn.execute(
+            'SELECT id, start_time, course_id FROM checkin_tasks ORDER BY start_time, id'
+        ).fetchall()
+        enrollments = conn.execute('SELECT course_id, user_id FROM course_enrollments').fetchall()
+
+        self._students = [(row[0], row[1], row[2]) for row in students]
+        self._student_ord = {row[0]: i for i, row in enumerate(students)}
+        self._task_ids = [row[0] for row in tasks]
+        self._task_ord = {row[0]: i for i, row in enumerate(tasks)}
+        self._task_starts = np.array([row[1] for row in tasks], dtype='datetime64[s]')
+        # -1 marks tasks without a course
+        self._task_courses = np.array([-1 if row[2] is None else row[2] for row in tasks], dtype=np.int64)
+        self._matrix = np.zeros((len(students), len(tasks)), dtype=np.uint8)
+
+        course_students = {}
+        for course_id, user_id in enrollments:
+            s = self._student_ord.get(user_id)
+            if s is not None:
+                course_students.setdefault(course_id, []).append(s)
+        self._course_students = {course_id: np.array(sorted(ords), dtype=np.int64)
+                                 for course_id, ords in course_students.items()}
+        self._expected = np.zeros((len(students), len(tasks)), dtype=np.uint8)
+        self._expected[:, self._task_courses == -1] = 1
+        for course_id, ords in self._course_students.items():
+            self._expected[np.ix_(ords, np.flatnonzero(self._task_courses == course_id))] = 1
+
+        self._latency_tasks = []
+        self._latency_chunks = []
+        self._last_record_id = 0
+        self._signature = signature
+
+    def _load_records(self, conn):
+        """Apply check-in records newer than the last one seen"""
+        # checkin_time defaults to CURRENT_TIMESTAMP (UTC) while task times
+        # are stored in local time, so convert before taking the difference
+        rows = conn.execute('''
+            SELECT cr.id, cr.task_id, cr.user_id,
+                   (julianday(cr.checkin_time, 'localtime') - julianday(t.start_time)) * 1440.0
+            FROM checkin_records cr
+            JOIN checkin_tasks t ON cr.task_id = t.id
+            WHERE cr.id > ?
+        ''', (self._last_record_id,)).fetchall()
+        if not rows:
+            return
+
+        data = np.array(rows, dtype=np.float64)
+        self._last_record_id = int(data[:, 0].max())
+        task_ords = np.array([self._task_ord.get(int(t), -1) for t in data[:, 1]])
+        student_ords = np.array([self._student_ord.get(int(u), -1) for u in data[:, 2]])
+        known = (task_ords >= 0) & (student_ords >= 0)
+        self._matrix[student_ords[known], task_ords[known]] = 1
+        self._latency_tasks.append(task_ords[known])
+        self._latency_chunks.append(data[known, 3])
+
+    def refresh(self):
+        """Bring the matrix up to date with the database"""
+        conn = get_db_connection()
+        try:
+            signature = self._fetch_signature(conn)
+            if signature != self._signature:
+                self._rebuild(conn, signature)
+            self._load_records(conn)
+        finally:
+            conn.close()
+
+    def _started_count(self):
+        now = np.datetime64(datetime.now().strftime('%Y-%m-%dT%H:%M:%S'))
+        return int(np.searchsorted(self._task_starts, now, side='right'))
+
+    def _scope(self, course_id):
+        """Student ordinals and started task ordinals in scope, in chronological order"""
+        started = np.arange(self._started_count())
+        if course_id is None:
+            return np.arange(len(self._students)), started
+        students = self._course_students.get(course_id, np.array([], dtype=np.int64))
+        return students, started[self._task_courses[started] == course_id]
+
+    def _weekly_rates(self, attended, expected, starts, window):
+        """Attendance rate per calendar week plus a rolling mean"""
+        if starts.size == 0 or attended.shape[0] == 0:
+            return {'labels': [], 'weekly_rates': [], 'rolling_rates': []}
+
+        days = starts.astype('datetime64[D]')
+        # 1970-01-01 was a Thursday; shift so that Monday == 0
+        week_starts = days - ((days.astype(np.int64) + 3) % 7)
+        weeks, week_index = np.unique(week_starts, return_inverse=True)
+
+        attended = np.bincount(week_index, weights=attended.sum(axis=0), minlength=len(weeks))
+        possible = np.bincount(week_index, weights=expected.sum(axis=0), minlength=len(weeks))
+        weekly = _percent(attended, possible)
+
+        # Rolling rate over the trailing window of weeks
+        cum_attended = np.concatenate(([0], np.cumsum(attended)))
+        cum_possible = np.concatenate(([0], np.cumsum(possible)))
+        upper = np.arange(1, len(weeks) + 1)
+        lower = np.maximum(upper - window, 0)
+        rolling = _percent(cum_attended[upper] - cum_attended[lower], cum_possible[upper] - cum_possible[lower])
+
+        return {
+            'labels': [str(week) for week in weeks],
+            'weekly_rates': np.round(weekly, 2).tolist(),
+            'rolling_rates': np.round(rolling, 2).tolist()
+        }
+
+    def _student_trends(self, students, attended, expected, recent_window, threshold):
+        """Per-student trend slopes and the at-risk list"""
+        attended = attended.astype(np.float64)
+        expected = expected.astype(np.float64)
+        counts = expected.sum(axis=1)
+        # A slope needs at least two expected tasks
+        keep = counts >= 2
+        if not keep.any():
+            return [], []
+        students, attended, expected, counts = students[keep], attended[keep], expected[keep], counts[keep]
+
+        # Least-squares slope of attendance (0/1) against task order over each
+        # student's expected tasks, in percentage points per task
+        x = np.arange(expected.shape[1], dtype=np.float64)
+        x_mean = expected @ x / counts
+        sxx = expected @ (x * x) - counts * x_mean * x_mean
+        sxy = attended @ x - x_mean * attended.sum(axis=1)
+        slopes = _percent(sxy, sxx)
+        overall = attended.sum(axis=1) / counts * 100
+
+        # The last recent_window expected tasks of each student
+        remaining = np.cumsum(expected[:, ::-1], axis=1)[:, ::-1]
+        recent_mask = expected * (remaining <= recent_window)
+        recent = (attended * recent_mask).sum(axis=1) / recent_mask.sum(axis=1) * 100
+
+        trends = []
+        for i, s in enumerate(students):
+            user_id, username, name = self._students[s]
+            trends.append({
+                'id': user_id,
+                'username': username,
+                'name': name,
+                'slope': round(float(slopes[i]), 3),
+                'overall_rate': round(float(overall[i]), 2),
+                'recent_rate': round(float(recent[i]), 2)
+            })
+
+        at_risk_ords = np.flatnonzero((recent < threshold) & (recent < overall))
+        at_risk_ords = at_risk_ords[np.lexsort((slopes[at_risk_ords], recent[at_risk_ords]))]
+        at_risk = [trends[i] for i in at_risk_ords]
+        return trends, at_risk
+
+    def _latency_distribution(self, course_id):
+        """Histogram and percentiles of minutes between start_time and check-in"""
+        if self._latency_chunks:
+            latencies = np.concatenate(self._latency_chunks)
+            if course_id is not None:
+                task_ords = np.concatenate(self._latency_tasks)
+                latencies = latencies[self._task_courses[task_ords] == course_id]
+        else:
+            latencies = np.array([], dtype=np.float64)
+        # Clamp clock skew so that early check-ins fall in the first bin
+        latencies = np.clip(latencies, 0, None)
+        counts, _ = np.histogram(latencies, bins=LATENCY_BINS)
+
+        percentiles = {}
+        if latencies.size:
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            percentiles = {'p50': round(float(p50), 2), 'p90': round(float(p90), 2), 'p99': round(float(p99), 2)}
+
+        return {
+            'labels': latency_labels(),
+            'counts': counts.tolist(),
+            'percentiles': percentiles
+        }
+
+    def get_trends(self, rolling_weeks=4, recent_window=5, threshold=60, course_id=None):
+        """Compute all trend analytics as a JSON-serializable dict,
+        optionally restricted to one course"""
+        with self._lock:
+            self.refresh()
+            students, tasks = self._scope(course_id)
+            expected = self._expected[np.ix_(students, tasks)]
+            # Ignore check-ins for tasks a student was not expected to attend
+            attended = self._matrix[np.ix_(students, tasks)] & expected
+            trends, at_risk = self._student_trends(students, attended, expected, recent_window, threshold)
+            return {
+                'weekly': self._weekly_rates(attended, expected, self._task_starts[tasks], rolling_weeks),
+                'student_trends': trends,
+                'at_risk': at_risk,
+                'latency': self._latency_distribution(course_id)
+            }
+
+
+# Shared per-process trend engine
+attendance_trends = AttendanceTrends()
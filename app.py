@@ -1,27 +1,43 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, Response
+from flask import Flask, render_template, request, redirect, url_for, session, flash, Response, jsonify
 from datetime import datetime
 import secrets
-import os
 import csv
 import io
+import json
+import base64
 import sqlite3
 
 from config import Config
 from database import (
     init_db, get_user_by_username, create_user, verify_password,
-    create_checkin_task, get_all_checkin_tasks, get_checkin_task_by_id,
-    get_checkin_task_by_code, create_checkin_record, get_checkin_records_by_task,
-    has_checked_in, get_all_students, get_student_attendance_stats,
-    get_task_attendance_stats, get_overall_stats, bulk_create_users
+    create_checkin_task, get_checkin_task_by_id,
+    get_checkin_task_by_code, create_checkin_record,
+    has_checked_in, get_overall_stats, bulk_create_users,
+    get_student_stats_page, get_task_stats_page, search_students, search_student_ids,
+    is_on_task_roster, create_course, get_all_courses, get_course_by_id,
+    get_course_students, enroll_students, unenroll_student, get_task_live_count, get_task_summary,
+    rebuild_student_search, STUDENT_STATS_SORT_COLUMNS, TASK_STATS_SORT_COLUMNS
 )
 from models import User, CheckinTask
+from repository import load_admin_task_list, load_student_task_list, load_roster_status, load_tasks
+from attendance_index import attendance_index
+from analytics import attendance_trends
+from http_cache import init_app as init_http_cache, versioned_json, conditional_page
+from task_summaries import init_app as init_task_summaries, summary_scheduler, load_task_summary, roster_csv
 
 app = Flask(__name__)
 app.config.from_object(Config)
+init_http_cache(app)
 
-# Initialize database on first run
-if not os.path.exists(app.config['DATABASE']):
-    init_db()
+# Initialize database; also creates tables added since the database was first created
+init_db()
+init_task_summaries(app)
+
+
+@app.cli.command('rebuild-student-search')
+def rebuild_student_search_command():
+    """Recompute student name pinyin and rebuild the search index"""
+    print(f'{rebuild_student_search()} students indexed')
 
 
 def login_required(f):
@@ -49,6 +65,82 @@ def admin_required(f):
     return decorated_function
 
 
+def encode_cursor(row, sort):
+    """Encode the keyset position after row as an opaque cursor string"""
+    raw = json.dumps([row[sort], row['id']], ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Decode a cursor string into a (sort value, id) tuple"""
+    try:
+        value, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    # Only values that sqlite can bind: anything else is a forged cursor
+    if not isinstance(row_id, int) or not isinstance(value, (str, int, float)):
+        raise ValueError('Invalid cursor')
+    return value, row_id
+
+
+def check_in(code, user_id):
+    """Validate a check-in code and record the student's check-in.
+    Returns (category, message): 'success', 'warning' if already checked in, or 'danger'.
+    Shared with the asyncio service in async_app.py"""
+    if not code:
+        return 'danger', '请输入签到码'
+    
+    task = get_checkin_task_by_code(code)
+    if not task:
+        return 'danger', '签到码不存在'
+    
+    if not CheckinTask.from_row(task).is_active():
+        return 'danger', '签到码已过期或尚未开始'
+    
+    if not is_on_task_roster(task, user_id):
+        return 'danger', '您不在该课程名单中'
+    
+    if has_checked_in(task['id'], user_id):
+        return 'warning', '您已经签到过了'
+    
+    if create_checkin_record(task['id'], user_id):
+        return 'success', f'签到成功：{task["title"]}'
+    return 'danger', '签到失败，请重试'
+
+
+def course_id_arg():
+    """Parse the optional ?course_id= filter. Raises ValueError if malformed"""
+    value = request.args.get('course_id', '').strip()
+    return int(value) if value else None
+
+
+def paged_stats_response(fetch_page, sort_columns, default_sort, default_order):
+    """Shared request parsing for the paginated statistics endpoints"""
+    sort = request.args.get('sort', default_sort)
+    order = request.args.get('order', default_order)
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), app.config['STATS_PAGE_MAX_LIMIT'])
+        after = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        course_id = course_id_arg()
+    except ValueError:
+        return jsonify({'error': '参数无效'}), 400
+    if sort not in sort_columns or order not in ('asc', 'desc'):
+        return jsonify({'error': '不支持的排序方式'}), 400
+    
+    def build_payload():
+        rows, has_more, total = fetch_page(sort=sort, descending=(order == 'desc'),
+                                           limit=limit, after=after, query=query or None,
+                                           course_id=course_id)
+        return {
+            'items': rows,
+            'total': total,
+            'next_cursor': encode_cursor(rows[-1], sort) if has_more else None
+        }
+    
+    return versioned_json(build_payload)
+
+
 @app.route('/')
 def index():
     """Home page"""
@@ -155,13 +247,7 @@ def student_dashboard():
     if session.get('role') == 'admin':
         return redirect(url_for('admin_dashboard'))
     
-    tasks = get_all_checkin_tasks()
-    task_list = []
-    for task in tasks:
-        task_dict = dict(task)
-        task_dict['has_checked_in'] = has_checked_in(task['id'], session['user_id'])
-        task_dict['is_active'] = CheckinTask.from_row(task).is_active()
-        task_list.append(task_dict)
+    task_list = load_student_task_list(session['user_id'])
     
     return render_template('student/dashboard.html', tasks=task_list)
 
@@ -174,47 +260,20 @@ def student_checkin():
         return redirect(url_for('admin_dashboard'))
     
     if request.method == 'POST':
-        code = request.form.get('code', '').strip()
-        
-        if not code:
-            flash('请输入签到码', 'danger')
-            return render_template('student/checkin.html')
-        
-        task = get_checkin_task_by_code(code)
-        if not task:
-            flash('签到码不存在', 'danger')
-            return render_template('student/checkin.html')
-        
-        task_obj = CheckinTask.from_row(task)
-        if not task_obj.is_active():
-            flash('签到码已过期或尚未开始', 'danger')
-            return render_template('student/checkin.html')
-        
-        if has_checked_in(task['id'], session['user_id']):
-            flash('您已经签到过了', 'warning')
-            return redirect(url_for('student_dashboard'))
-        
-        if create_checkin_record(task['id'], session['user_id']):
-            flash(f'签到成功：{task["title"]}', 'success')
+        category, message = check_in(request.form.get('code', '').strip(), session['user_id'])
+        flash(message, category)
+        if category != 'danger':
             return redirect(url_for('student_dashboard'))
-        else:
-            flash('签到失败，请重试', 'danger')
     
     return render_template('student/checkin.html')
 
 
 @app.route('/admin/dashboard')
 @admin_required
+@conditional_page
 def admin_dashboard():
     """Admin dashboard"""
-    tasks = get_all_checkin_tasks()
-    task_list = []
-    for task in tasks:
-        task_dict = dict(task)
-        records = get_checkin_records_by_task(task['id'])
-        task_dict['checkin_count'] = len(records)
-        task_dict['is_active'] = CheckinTask.from_row(task).is_active()
-        task_list.append(task_dict)
+    task_list = load_admin_task_list()
     
     return render_template('admin/dashboard.html', tasks=task_list)
 
@@ -230,7 +289,7 @@ def create_task():
         
         if not title or not start_time or not end_time:
             flash('请填写完整信息', 'danger')
-            return render_template('admin/create_task.html')
+            return render_template('admin/create_task.html', courses=get_all_courses())
         
         try:
             # Validate datetime format
@@ -238,7 +297,7 @@ def create_task():
             datetime.strptime(end_time, '%Y-%m-%dT%H:%M')
         except ValueError:
             flash('时间格式不正确', 'danger')
-            return render_template('admin/create_task.html')
+            return render_template('admin/create_task.html', courses=get_all_courses())
         
         # Convert to SQLite datetime format
         start_time = datetime.strptime(start_time, '%Y-%m-%dT%H:%M').strftime('%Y-%m-%d %H:%M:%S')
@@ -246,23 +305,34 @@ def create_task():
         
         if start_time >= end_time:
             flash('结束时间必须晚于开始时间', 'danger')
-            return render_template('admin/create_task.html')
+            return render_template('admin/create_task.html', courses=get_all_courses())
+        
+        course_id = request.form.get('course_id', '').strip()
+        if course_id:
+            if not course_id.isdigit() or not get_course_by_id(int(course_id)):
+                flash('课程不存在', 'danger')
+                return render_template('admin/create_task.html', courses=get_all_courses())
+            course_id = int(course_id)
+        else:
+            course_id = None
         
         # Generate unique code (8 bytes = 16 hex characters for better security)
         code = secrets.token_hex(8).upper()
         
-        task_id = create_checkin_task(title, code, start_time, end_time, session['user_id'])
+        task_id = create_checkin_task(title, code, start_time, end_time, session['user_id'], course_id)
         if task_id:
+            summary_scheduler.schedule(end_time)
             flash(f'签到任务创建成功！签到码：{code}', 'success')
             return redirect(url_for('admin_dashboard'))
         else:
             flash('创建失败，请重试', 'danger')
     
-    return render_template('admin/create_task.html')
+    return render_template('admin/create_task.html', courses=get_all_courses())
 
 
 @app.route('/admin/view_records/<int:task_id>')
 @admin_required
+@conditional_page
 def view_records(task_id):
     """View checkin records for a task"""
     task = get_checkin_task_by_id(task_id)
@@ -270,32 +340,16 @@ def view_records(task_id):
         flash('签到任务不存在', 'danger')
         return redirect(url_for('admin_dashboard'))
     
-    records = get_checkin_records_by_task(task_id)
-    students = get_all_students()
-    
-    # Create a set of checked-in user IDs
-    checked_in_ids = {record['user_id'] for record in records}
-    
-    # Prepare student status list
-    student_status = []
-    for student in students:
-        status = {
-            'id': student['id'],
-            'username': student['username'],
-            'name': student['name'],
-            'checked_in': student['id'] in checked_in_ids,
-            'checkin_time': None
-        }
-        
-        # Find checkin time if checked in
-        for record in records:
-            if record['user_id'] == student['id']:
-                status['checkin_time'] = record['checkin_time']
-                break
-        
-        student_status.append(status)
+    query = request.args.get('q', '').strip()
+    student_status = load_roster_status(task_id, task['course_id'])
+    checkin_count = sum(1 for status in student_status if status.checked_in)
+    roster_size = len(student_status)
+    if query:
+        matched_ids = search_student_ids(query)
+        student_status = [status for status in student_status if status.id in matched_ids]
     
-    return render_template('admin/view_records.html', task=task, records=records, student_status=student_status)
+    return render_template('admin/view_records.html', task=task, checkin_count=checkin_count,
+                           roster_size=roster_size, student_status=student_status, query=query)
 
 
 @app.route('/admin/export_records/<int:task_id>')
@@ -306,27 +360,12 @@ def export_records(task_id):
     if not task:
         return '任务不存在', 404
     
-    records = get_checkin_records_by_task(task_id)
-    students = get_all_students()
-    
-    # Create a set of checked-in user IDs
-    checked_in_ids = {record['user_id'] for record in records}
-    
-    # Create a map of user_id to checkin_time
-    checkin_times = {record['user_id']: record['checkin_time'] for record in records}
-    
-    # Generate CSV content using csv module for proper escaping
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['学号', '姓名', '签到状态', '签到时间'])
-    
-    for student in students:
-        status = '已签到' if student['id'] in checked_in_ids else '未签到'
-        checkin_time = checkin_times.get(student['id'], '')
-        writer.writerow([student['username'], student['name'], status, checkin_time])
-    
-    csv_content = output.getvalue()
-    output.close()
+    # Closed tasks are served from the CSV frozen in their summary
+    summary = get_task_summary(task_id)
+    if summary is not None:
+        csv_content = summary['csv_content']
+    else:
+        csv_content = roster_csv(load_roster_status(task_id, task['course_id']))
     
     return Response(
         csv_content,
@@ -335,18 +374,218 @@ def export_records(task_id):
     )
 
 
+@app.route('/admin/api/tasks/<int:task_id>/summary')
+@admin_required
+def api_task_summary(task_id):
+    """Task summary: counts, absent students and check-in time histogram"""
+    task = get_checkin_task_by_id(task_id)
+    if not task:
+        return jsonify({'error': '任务不存在'}), 404
+    
+    def build_payload():
+        summary = load_task_summary(task)
+        del summary['csv_content']
+        return summary
+    
+    return versioned_json(build_payload)
+
+
+@app.route('/admin/api/tasks/<int:task_id>/count')
+@admin_required
+def api_task_live_count(task_id):
+    """Live check-in count of a task.
+    The asyncio service (async_app.py) also long-polls on ?after=<count>"""
+    live_count = get_task_live_count(task_id)
+    if not live_count:
+        return jsonify({'error': '任务不存在'}), 404
+    return versioned_json(lambda: live_count)
+
+
 @app.route('/admin/statistics')
 @admin_required
+@conditional_page
 def statistics():
     """Statistics page"""
-    student_stats = get_student_attendance_stats()
-    task_stats = get_task_attendance_stats()
-    overall_stats = get_overall_stats()
+    try:
+        course_id = course_id_arg()
+    except ValueError:
+        course_id = None
+    course = get_course_by_id(course_id) if course_id is not None else None
+    if course_id is not None and not course:
+        flash('课程不存在', 'danger')
+        return redirect(url_for('statistics'))
+    
+    overall_stats = get_overall_stats(course_id)
+    absence_threshold = app.config['ABSENCE_ALERT_THRESHOLD']
+    consecutive_absentees = attendance_index.consecutive_absentees(absence_threshold, course_id=course_id)
+    perfect_attendance = attendance_index.perfect_attendance(course_id=course_id)
+    
+    # Current attendance streaks (top 10) alongside each student's rate
+    rates = {student['id']: student['attendance_rate']
+             for student in attendance_index.attendance_rates(course_id=course_id)}
+    streaks = sorted(attendance_index.attendance_streaks(course_id=course_id),
+                     key=lambda item: (-item['current_streak'], -item['longest_streak'], item['username']))
+    streak_ranking = [dict(student, attendance_rate=rates[student['id']])
+                      for student in streaks[:10] if student['current_streak'] > 0]
+    
+    # Attendee overlap of two tasks picked on the page
+    tasks = [task for task in load_tasks() if course_id is None or task.course_id == course_id]
+    task_a = request.args.get('task_a', type=int)
+    task_b = request.args.get('task_b', type=int)
+    overlap = attendance_index.task_overlap(task_a, task_b) if task_a and task_b else None
     
     return render_template('admin/statistics.html', 
-                         student_stats=student_stats,
-                         task_stats=task_stats,
-                         overall_stats=overall_stats)
+                         courses=get_all_courses(),
+                         course=course,
+                         overall_stats=overall_stats,
+                         absence_threshold=absence_threshold,
+                         consecutive_absentees=consecutive_absentees,
+                         perfect_attendance=perfect_attendance,
+                         streak_ranking=streak_ranking,
+                         tasks=tasks,
+                         task_a=task_a,
+                         task_b=task_b,
+                         overlap=overlap)
+
+
+@app.route('/admin/api/stats/students')
+@admin_required
+def api_student_stats():
+    """Paginated student attendance statistics"""
+    return paged_stats_response(get_student_stats_page, STUDENT_STATS_SORT_COLUMNS, 'username', 'asc')
+
+
+@app.route('/admin/api/stats/tasks')
+@admin_required
+def api_task_stats():
+    """Paginated task check-in statistics"""
+    return paged_stats_response(get_task_stats_page, TASK_STATS_SORT_COLUMNS, 'created_at', 'desc')
+
+
+@app.route('/admin/api/stats/overall')
+@admin_required
+def api_overall_stats():
+    """Overall statistics"""
+    try:
+        course_id = course_id_arg()
+    except ValueError:
+        return jsonify({'error': '参数无效'}), 400
+    return versioned_json(lambda: get_overall_stats(course_id))
+
+
+@app.route('/admin/api/students/search')
+@admin_required
+def api_search_students():
+    """Search students by 学号, name or pinyin"""
+    query = request.args.get('q', '').strip()
+    try:
+        limit = min(max(int(request.args.get('limit', app.config['SEARCH_PAGE_SIZE'])), 1),
+                    app.config['SEARCH_PAGE_SIZE'])
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': '参数无效'}), 400
+    if not query:
+        return jsonify({'items': [], 'next_offset': None})
+    
+    # Results are capped at SEARCH_MAX_RESULTS in total
+    max_results = app.config['SEARCH_MAX_RESULTS']
+    limit = min(limit, max(max_results - offset, 0))
+    
+    def build_payload():
+        if limit == 0:
+            return {'items': [], 'next_offset': None}
+        rows, has_more = search_students(query, limit=limit, offset=offset)
+        next_offset = offset + limit if has_more and offset + limit < max_results else None
+        return {'items': rows, 'next_offset': next_offset}
+    
+    return versioned_json(build_payload)
+
+
+@app.route('/admin/statistics/trends')
+@admin_required
+def statistics_trends():
+    """Attendance trend analytics as JSON"""
+    try:
+        course_id = course_id_arg()
+    except ValueError:
+        return jsonify({'error': '参数无效'}), 400
+    trends = attendance_trends.get_trends(
+        rolling_weeks=app.config['TREND_ROLLING_WEEKS'],
+        recent_window=app.config['AT_RISK_RECENT_TASKS'],
+        threshold=app.config['AT_RISK_THRESHOLD'],
+        course_id=course_id
+    )
+    return jsonify(trends)
+
+
+@app.route('/admin/courses', methods=['GET', 'POST'])
+@admin_required
+def courses():
+    """List and create courses"""
+    if request.method == 'POST':
+        name = request.form.get('name', '').strip()
+        if not name:
+            flash('请输入课程名称', 'danger')
+        elif create_course(name, session['user_id']):
+            flash(f'课程创建成功：{name}', 'success')
+        else:
+            flash('课程名称已存在', 'danger')
+        return redirect(url_for('courses'))
+    
+    return render_template('admin/courses.html', courses=get_all_courses())
+
+
+@app.route('/admin/courses/<int:course_id>', methods=['GET', 'POST'])
+@admin_required
+def course_detail(course_id):
+    """Course roster: enroll students by 学号 (typed or from a CSV file)"""
+    course = get_course_by_id(course_id)
+    if not course:
+        flash('课程不存在', 'danger')
+        return redirect(url_for('courses'))
+    
+    if request.method == 'POST':
+        usernames = request.form.get('usernames', '').split()
+        file = request.files.get('file')
+        if file and file.filename:
+            if not file.filename.endswith('.csv'):
+                flash('只支持 CSV 格式文件', 'danger')
+                return redirect(request.url)
+            try:
+                stream = io.StringIO(file.stream.read().decode('utf-8-sig'), newline=None)
+            except UnicodeDecodeError:
+                flash('文件编码必须为 UTF-8', 'danger')
+                return redirect(request.url)
+            # First column holds the 学号; the header row is skipped
+            rows = list(csv.reader(stream))[1:]
+            usernames.extend(row[0].strip() for row in rows if row and row[0].strip())
+        
+        if not usernames:
+            flash('请输入学号或选择文件', 'danger')
+            return redirect(request.url)
+        
+        result = enroll_students(course_id, list(dict.fromkeys(usernames)))
+        if result['success_count'] > 0:
+            flash(f'成功添加 {result["success_count"]} 个学生', 'success')
+        if result['skip_count'] > 0:
+            flash(f'跳过 {result["skip_count"]} 个已在名单中的学生', 'warning')
+        for error in result['errors']:
+            flash(error, 'danger')
+        return redirect(url_for('course_detail', course_id=course_id))
+    
+    return render_template('admin/course_detail.html', course=course,
+                           students=get_course_students(course_id))
+
+
+@app.route('/admin/courses/<int:course_id>/unenroll/<int:user_id>', methods=['POST'])
+@admin_required
+def unenroll(course_id, user_id):
+    """Remove a student from a course roster"""
+    if unenroll_student(course_id, user_id):
+        flash('已将学生移出课程', 'success')
+    else:
+        flash('该学生不在课程名单中', 'warning')
+    return redirect(url_for('course_detail', course_id=course_id))
 
 
 @app.route('/admin/import_students', methods=['GET', 'POST'])
@@ -0,0 +1,389 @@
+"""Asyncio (ASGI) service mode for high-concurrency check-in events.
+
+Check-ins (POST /student/checkin) and live counts
+(/admin/api/tasks/<id>/count) are handled on the event loop, with their
+SQLite work run in a bounded thread pool, so one process can hold many
+thousands of waiting connections. Every other route is passed to the Flask
+app through a WSGI bridge running in its own thread pool, so the service
+can run stand-alone or behind a proxy that only routes those two paths here.
+
+Sessions are read and written with the Flask app's own signing serializer;
+set the same SECRET_KEY for both modes when they serve the same users.
+
+Run with:  python async_app.py   (requires uvicorn)
+"""
+import asyncio
+import functools
+import json
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from urllib.parse import parse_qsl
+
+from werkzeug.http import parse_cookie, dump_cookie
+
+from app import app as flask_app, check_in
+from database import get_task_live_count, get_data_versions
+from models import current_time
+
+
+config = flask_app.config
+
+
+class ServiceBusy(Exception):
+    """Raised when an executor already has its maximum of pending jobs"""
+
+
+class BoundedExecutor:
+    """Thread pool with a cap on queued jobs, for blocking work called from the event loop"""
+
+    def __init__(self, max_workers, max_pending, name):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.max_pending = max_pending
+        self.pending = 0
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool. Raises ServiceBusy if too many jobs are waiting"""
+        if self.pending >= self.max_pending:
+            raise ServiceBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+# SQLite work of the native handlers, and whole requests passed to Flask
+db_executor = BoundedExecutor(config['ASYNC_DB_WORKERS'], config['ASYNC_MAX_PENDING'], 'async-db')
+wsgi_executor = BoundedExecutor(config['ASYNC_WSGI_WORKERS'], config['ASYNC_MAX_PENDING'], 'async-wsgi')
+
+
+class RecordsWatcher:
+    """Wakes long-polling live-count requests when check-ins are recorded.
+
+    Check-ins handled by this process wake waiters immediately; those of
+    other processes are noticed by polling the records data version. The
+    polling task only runs while long-polls are waiting.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._event = None
+        self._task = None
+        self._version = None
+        self._waiters = 0
+
+    def notify(self):
+        if self._event is not None:
+            self._event.set()
+            self._event = asyncio.Event()
+
+    async def wait(self, timeout):
+        """Wait until a new check-in is recorded, or timeout seconds"""
+        if self._event is None:
+            self._event = asyncio.Event()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._poll())
+        self._waiters += 1
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters -= 1
+
+    def stop(self):
+        """Cancel the polling task"""
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _poll(self):
+        # The version seen before an idle period is kept: if it changed in
+        # between, the first poll wakes the waiters, which then re-check
+        try:
+            while self._waiters:
+                try:
+                    version = (await db_executor.run(get_data_versions))['records']
+                except ServiceBusy:
+                    version = self._version
+                if self._version is not None and version != self._version:
+                    self.notify()
+                self._version = version
+                await asyncio.sleep(self.interval)
+        finally:
+            self._task = None
+
+
+records_watcher = RecordsWatcher(config['ASYNC_LIVE_POLL_INTERVAL'])
+
+
+class Request:
+    """The parts of an ASGI HTTP request the native handlers need"""
+
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.body = body
+        self.headers = {}
+        for name, value in scope['headers']:
+            self.headers[name.decode('latin-1').lower()] = value.decode('latin-1')
+        self.args = _parse_qs(scope['query_string'])
+
+    @property
+    def form(self):
+        if self.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+            return _parse_qs(self.body)
+        return {}
+
+    @property
+    def wants_json(self):
+        return 'application/json' in self.headers.get('accept', '')
+
+
+def _parse_qs(data):
+    return dict(parse_qsl(data.decode('utf-8', 'replace'), keep_blank_values=True))
+
+
+def load_session(request):
+    """Read the Flask session cookie. Returns an empty session if missing or invalid"""
+    interface = flask_app.session_interface
+    serializer = interface.get_signing_serializer(flask_app)
+    value = parse_cookie(request.headers.get('cookie', '')).get(config['SESSION_COOKIE_NAME'])
+    if value:
+        max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        try:
+            return interface.session_class(serializer.loads(value, max_age=max_age))
+        except Exception:
+            pass
+    return interface.session_class()
+
+
+def session_cookie(session):
+    """Set-Cookie header value for a session, as Flask would write it"""
+    interface = flask_app.session_interface
+    serializer = interface.get_signing_serializer(flask_app)
+    return dump_cookie(
+        config['SESSION_COOKIE_NAME'],
+        serializer.dumps(dict(session)),
+        expires=interface.get_expiration_time(flask_app, session),
+        path=interface.get_cookie_path(flask_app),
+        domain=interface.get_cookie_domain(flask_app),
+        secure=interface.get_cookie_secure(flask_app),
+        httponly=interface.get_cookie_httponly(flask_app),
+        samesite=interface.get_cookie_samesite(flask_app)
+    )
+
+
+def flash(session, message, category):
+    """Queue a message for the next page rendered by the Flask app"""
+    flashes = session.get('_flashes', [])
+    flashes.append((category, message))
+    session['_flashes'] = flashes
+
+
+async def send_response(send, status, body=b'', headers=()):
+    headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_json(send, status, payload, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    headers = [('content-type', 'application/json'), ('cache-control', 'no-cache')] + list(headers)
+    await send_response(send, status, body, headers)
+
+
+async def redirect(send, location, session):
+    await send_response(send, 302, headers=[
+        ('location', location),
+        ('set-cookie', session_cookie(session)),
+        ('vary', 'Cookie')
+    ])
+
+
+async def student_checkin(request, send):
+    """POST /student/checkin: same checks and messages as the Flask view.
+    Browsers get the message flashed and a redirect; JSON clients get it in the body"""
+    session = load_session(request)
+    if 'user_id' not in session or session.get('role') == 'admin':
+        if request.wants_json:
+            await send_json(send, 401 if 'user_id' not in session else 403, {'error': '需要学生账号登录'})
+        elif 'user_id' not in session:
+            flash(session, '请先登录', 'warning')
+            await redirect(send, '/login', session)
+        else:
+            await redirect(send, '/admin/dashboard', session)
+        return
+
+    category, message = await db_executor.run(check_in, request.form.get('code', '').strip(), session['user_id'])
+    if category == 'success':
+        records_watcher.notify()
+
+    if request.wants_json:
+        status = {'success': 200, 'warning': 409}.get(category, 400)
+        await send_json(send, status, {'category': category, 'message': message})
+        return
+    flash(session, message, category)
+    # Errors go back to the form (rendered by the Flask app) instead of re-rendering it here
+    await redirect(send, '/student/checkin' if category == 'danger' else '/student/dashboard', session)
+
+
+async def task_live_count(request, send, task_id):
+    """GET /admin/api/tasks/<id>/count. With ?after=<count>, waits up to
+    ASYNC_LIVE_COUNT_TIMEOUT seconds for the count to change while the task is active"""
+    session = load_session(request)
+    if session.get('role') != 'admin':
+        await send_json(send, 403, {'error': '需要管理员权限'})
+        return
+    try:
+        after = int(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        await send_json(send, 400, {'error': '参数无效'})
+        return
+
+    live_count = await db_executor.run(get_task_live_count, task_id)
+    if not live_count:
+        await send_json(send, 404, {'error': '任务不存在'})
+        return
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + config['ASYNC_LIVE_COUNT_TIMEOUT']
+    while (after is not None and live_count['checkin_count'] == after
+           and live_count['start_time'] <= current_time() <= live_count['end_time']
+           and loop.time() < deadline):
+        await records_watcher.wait(deadline - loop.time())
+        live_count = await db_executor.run(get_task_live_count, task_id)
+    await send_json(send, 200, live_count)
+
+
+ROUTES = [
+    ('POST', re.compile(r'^/student/checkin$'), student_checkin),
+    ('GET', re.compile(r'^/admin/api/tasks/(\d+)/count$'), task_live_count),
+]
+
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        else:
+            key = f'HTTP_{name}'
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def _call_wsgi(environ):
+    """Run the Flask app on one request. Returns (status, headers, body)"""
+    response = {}
+    chunks = []
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+        return chunks.append
+
+    result = flask_app(environ, start_response)
+    try:
+        chunks.extend(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], b''.join(chunks)
+
+
+# read_body result when the client disconnected before sending the whole body
+DISCONNECTED = object()
+
+
+async def read_body(receive, limit):
+    """Read the request body. Returns None if it exceeds limit bytes, or
+    DISCONNECTED if the client went away"""
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return DISCONNECTED
+        body += message.get('body', b'')
+        if len(body) > limit:
+            return None
+        if not message.get('more_body'):
+            break
+    return bytes(body)
+
+
+async def application(scope, receive, send):
+    """ASGI entry point"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                records_watcher.stop()
+                db_executor.shutdown()
+                wsgi_executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    body = await read_body(receive, config['ASYNC_MAX_BODY_SIZE'])
+    if body is DISCONNECTED:
+        # Nobody is left to answer, and a truncated check-in must not be handled
+        return
+    if body is None:
+        await send_response(send, 413, '请求内容过大'.encode('utf-8'), [('content-type', 'text/plain; charset=utf-8')])
+        return
+
+    try:
+        for method, pattern, handler in ROUTES:
+            match = pattern.match(scope['path'])
+            if match and scope['method'] == method:
+                await handler(Request(scope, body), send, *(int(group) for group in match.groups()))
+                return
+        status, headers, response_body = await wsgi_executor.run(_call_wsgi, _wsgi_environ(scope, body))
+    except ServiceBusy:
+        await send_response(send, 503, '服务器繁忙，请稍后重试'.encode('utf-8'),
+                            [('content-type', 'text/plain; charset=utf-8'), ('retry-after', '1')])
+        return
+    # Flask already set Content-Length for buffered responses
+    headers = [(name, value) for name, value in headers if name.lower() != 'content-length']
+    await send_response(send, status, response_body, headers)
+
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        sys.exit('异步模式需要安装 uvicorn：pip install uvicorn')
+    uvicorn.run(application, host=config['ASYNC_HOST'], port=config['ASYNC_PORT'],
+                backlog=config['ASYNC_BACKLOG'], log_level='warning')
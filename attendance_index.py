@@ -0,0 +1,261 @@
+import threading
+from bisect import bisect_right
+from datetime import datetime
+
+from database import get_db_connection
+
+
+def _popcount(bits):
+    """Count set bits of a non-negative int"""
+    return bin(bits).count('1')
+
+
+def _longest_run(bits):
+    """Length of the longest run of consecutive set bits"""
+    run = 0
+    while bits:
+        bits &= bits >> 1
+        run += 1
+    return run
+
+
+def _ordinals(bits):
+    """Yield the positions of set bits, lowest first"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class AttendanceIndex:
+    """In-memory bitmap index over checkin_records.
+
+    Students and tasks are mapped to dense ordinals, with tasks ordered by
+    start_time. Tasks without a course are expected of every student;
+    course tasks only of enrolled students. For each student the check-ins
+    are kept packed over their own chronological sequence of expected
+    tasks, once across all tasks and once per enrolled course, so that
+    absences, streaks and rates are plain bit operations on a prefix of
+    that sequence (the tasks that have started). A bitset per task over
+    student ordinals answers attendee-set questions such as the overlap of
+    two tasks.
+
+    Like the trend engine, the index picks up new check-in records by
+    record id and only rebuilds when students, tasks or enrollments change
+    (possibly in another worker process).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._last_record_id = 0
+        self._students = []
+        self._student_ord = {}
+        self._task_starts = []
+        self._task_courses = []
+        self._task_ord = {}
+        self._task_bits = []
+        self._course_tasks = {}
+        self._course_students = {}
+        self._student_expected = []
+        self._student_packed = []
+        self._course_packed = {}
+
+    def _fetch_signature(self, conn):
+        """Data versions of the student, task and enrollment sets"""
+        return tuple(row[0] for row in conn.execute(
+            "SELECT version FROM data_versions WHERE name IN ('users', 'tasks', 'courses') ORDER BY name"
+        ))
+
+    def _rebuild(self, conn, signature):
+        students = conn.execute(
+            'SELECT id, username, name FROM users WHERE role = ? ORDER BY username',
+            ('student',)
+        ).fetchall()
+        tasks = conn.execute(
+            'SELECT id, start_time, course_id FROM checkin_tasks ORDER BY start_time, id'
+        ).fetchall()
+        enrollments = conn.execute('SELECT course_id, user_id FROM course_enrollments').fetchall()
+
+        open_tasks = 0
+        course_tasks = {}
+        for t, row in enumerate(tasks):
+            if row[2] is None:
+                open_tasks |= 1 << t
+            else:
+                course_tasks[row[2]] = course_tasks.get(row[2], 0) | 1 << t
+
+        student_ord = {row[0]: i for i, row in enumerate(students)}
+        course_students = {}
+        student_expected = [open_tasks] * len(students)
+        for course_id, user_id in enrollments:
+            s = student_ord.get(user_id)
+            if s is None:
+                continue
+            course_students[course_id] = course_students.get(course_id, 0) | 1 << s
+            student_expected[s] |= course_tasks.get(course_id, 0)
+
+        self._students = [(row[0], row[1], row[2]) for row in students]
+        self._student_ord = student_ord
+        self._task_starts = [row[1] for row in tasks]
+        self._task_courses = [row[2] for row in tasks]
+        self._task_ord = {row[0]: i for i, row in enumerate(tasks)}
+        self._task_bits = [0] * len(tasks)
+        self._course_tasks = course_tasks
+        self._course_students = course_students
+        self._student_expected = student_expected
+        self._student_packed = [0] * len(students)
+        self._course_packed = {course_id: {} for course_id in course_students}
+        self._last_record_id = 0
+        self._signature = signature
+
+    def _load_records(self, conn):
+        """Apply check-in records newer than the last one seen"""
+        rows = conn.execute(
+            'SELECT id, task_id, user_id FROM checkin_records WHERE id > ? ORDER BY id',
+            (self._last_record_id,)
+        ).fetchall()
+        for record_id, task_id, user_id in rows:
+            self._last_record_id = record_id
+            t = self._task_ord.get(task_id)
+            s = self._student_ord.get(user_id)
+            if t is None or s is None:
+                continue
+            earlier = (1 << t) - 1
+            expected = self._student_expected[s]
+            # Ignore check-ins for tasks the student was not expected to attend
+            if not expected >> t & 1:
+                continue
+            self._task_bits[t] |= 1 << s
+            self._student_packed[s] |= 1 << _popcount(expected & earlier)
+            course_id = self._task_courses[t]
+            if course_id is not None:
+                packed = self._course_packed[course_id]
+                packed[s] = packed.get(s, 0) | 1 << _popcount(self._course_tasks[course_id] & earlier)
+
+    def refresh(self):
+        """Bring the index up to date with the database"""
+        conn = get_db_connection()
+        try:
+            # Read the signature and records from one snapshot
+            conn.execute('BEGIN')
+            signature = self._fetch_signature(conn)
+            if signature != self._signature:
+                self._rebuild(conn, signature)
+            self._load_records(conn)
+            conn.rollback()
+        finally:
+            conn.close()
+
+    def _started_mask(self, now=None):
+        """Bitmask of the tasks that have started (a contiguous low run)"""
+        if now is None:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return (1 << bisect_right(self._task_starts, now)) - 1
+
+    def _task_roster(self, t):
+        """Bitmask of the students expected to check in for task t"""
+        course_id = self._task_courses[t]
+        if course_id is None:
+            return (1 << len(self._students)) - 1
+        return self._course_students.get(course_id, 0)
+
+    def _scoped_sequences(self, course_id, now):
+        """Yield (s, attended, length) for every student in scope, where attended
+        holds the student's check-ins packed over their expected started tasks"""
+        started = self._started_mask(now)
+        if course_id is None:
+            for s, packed in enumerate(self._student_packed):
+                length = _popcount(self._student_expected[s] & started)
+                yield s, packed & ((1 << length) - 1), length
+        else:
+            length = _popcount(self._course_tasks.get(course_id, 0) & started)
+            packed = self._course_packed.get(course_id, {})
+            for s in _ordinals(self._course_students.get(course_id, 0)):
+                yield s, packed.get(s, 0) & ((1 << length) - 1), length
+
+    def _student_dict(self, s, **extra):
+        user_id, username, name = self._students[s]
+        result = {'id': user_id, 'username': username, 'name': name}
+        result.update(extra)
+        return result
+
+    def consecutive_absentees(self, min_run, course_id=None, now=None):
+        """Students who missed at least min_run consecutive expected tasks"""
+        with self._lock:
+            self.refresh()
+            results = []
+            for s, attended, length in self._scoped_sequences(course_id, now):
+                absent = ((1 << length) - 1) & ~attended
+                # Cheap pre-check: a run of min_run needs that many set bits
+                if _popcount(absent) < min_run:
+                    continue
+                run = _longest_run(absent)
+                if run >= min_run:
+                    results.append(self._student_dict(s, absent_run=run))
+            results.sort(key=lambda item: (-item['absent_run'], item['username']))
+            return results
+
+    def perfect_attendance(self, course_id=None, now=None):
+        """Students who checked in for every expected task that has started"""
+        with self._lock:
+            self.refresh()
+            return [self._student_dict(s)
+                    for s, attended, length in self._scoped_sequences(course_id, now)
+                    if length and attended == (1 << length) - 1]
+
+    def attendance_streaks(self, course_id=None, now=None):
+        """Current and longest attendance streak of every student in scope"""
+        with self._lock:
+            self.refresh()
+            results = []
+            for s, attended, length in self._scoped_sequences(course_id, now):
+                absent = ((1 << length) - 1) & ~attended
+                results.append(self._student_dict(
+                    s,
+                    current_streak=length - absent.bit_length(),
+                    longest_streak=_longest_run(attended)
+                ))
+            return results
+
+    def attendance_rates(self, course_id=None, now=None):
+        """Check-in count and attendance rate (%) over expected started tasks
+        of every student in scope"""
+        with self._lock:
+            self.refresh()
+            results = []
+            for s, attended, length in self._scoped_sequences(course_id, now):
+                count = _popcount(attended)
+                results.append(self._student_dict(
+                    s,
+                    checkin_count=count,
+                    expected_tasks=length,
+                    attendance_rate=(count / length * 100) if length else 0
+                ))
+            return results
+
+    def task_overlap(self, task_a, task_b):
+        """Compare the attendee sets of two tasks: students on either roster who
+        checked in for both, only one of them, or neither"""
+        with self._lock:
+            self.refresh()
+            attendees = []
+            roster = 0
+            for task_id in (task_a, task_b):
+                t = self._task_ord.get(task_id)
+                if t is None:
+                    attendees.append(0)
+                else:
+                    attendees.append(self._task_bits[t])
+                    roster |= self._task_roster(t)
+            a, b = attendees
+            return {
+                'both': _popcount(a & b),
+                'only_a': _popcount(a & ~b),
+                'only_b': _popcount(b & ~a),
+                'neither': _popcount(roster & ~(a | b))
+            }
+
+
+# Shared per-process index
+attendance_index = AttendanceIndex()
@@ -0,0 +1,140 @@
+"""Check-in burst benchmark for comparing the synchronous and asyncio modes.
+
+Run from the directory holding the server's checkin.db, with the same
+SECRET_KEY as the server (session cookies are signed locally):
+
+    SECRET_KEY=... python app.py                 # synchronous mode, port 5000
+    SECRET_KEY=... python async_app.py           # asyncio mode, port 8000
+    SECRET_KEY=... python bench_checkin.py --url http://127.0.0.1:8000
+
+Creates bench students (once) and a fresh task, then every student checks
+in concurrently while admin clients poll the live count.
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import sys
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlencode
+
+# The benchmark only needs the app for its session signing and database helpers
+os.environ.setdefault('TASK_SUMMARY_SCHEDULER', 'False')
+
+from app import app as flask_app
+from database import bulk_create_users, create_checkin_task, get_user_by_username, get_task_live_count
+
+
+def session_cookie(data):
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    return f'{flask_app.config["SESSION_COOKIE_NAME"]}={serializer.dumps(data)}'
+
+
+def prepare(student_count):
+    """Create the bench students and an active task.
+    Returns (task_id, code, student cookies, admin cookie)"""
+    # Password hashing makes the first run slow; later runs reuse the students
+    result = bulk_create_users([(f'bench{i:05d}', secrets.token_hex(8), f'压测学生{i}') for i in range(student_count)])
+    if result['success_count']:
+        print(f'created {result["success_count"]} bench students')
+
+    cookies = []
+    for i in range(student_count):
+        user = get_user_by_username(f'bench{i:05d}')
+        cookies.append(session_cookie({'user_id': user['id'], 'username': user['username'],
+                                       'name': user['name'], 'role': 'student'}))
+
+    now = datetime.now()
+    code = secrets.token_hex(8).upper()
+    admin = get_user_by_username('admin')
+    task_id = create_checkin_task('压测任务', code, (now - timedelta(minutes=1)).strftime('%Y-%m-%d %H:%M:%S'),
+                                  (now + timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S'), admin['id'])
+    admin_cookie = session_cookie({'user_id': admin['id'], 'username': admin['username'],
+                                   'name': admin['name'], 'role': 'admin'})
+    return task_id, code, cookies, admin_cookie
+
+
+async def http_request(host, port, method, path, cookie, body=b'', content_type=None):
+    """Send one HTTP/1.1 request on a new connection. Returns the status code"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close',
+                 f'Cookie: {cookie}', f'Content-Length: {len(body)}']
+        if content_type:
+            lines.append(f'Content-Type: {content_type}')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1]) if status_line else 0
+    finally:
+        writer.close()
+
+
+async def run(url, code, task_id, cookies, admin_cookie, concurrency, pollers):
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+    done = False
+
+    async def one_checkin(cookie):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                status = await http_request(host, port, 'POST', '/student/checkin', cookie,
+                                            urlencode({'code': code}).encode('ascii'),
+                                            'application/x-www-form-urlencoded')
+            except OSError:
+                status = 'error'
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    async def poll_count():
+        polls = 0
+        while not done:
+            try:
+                await http_request(host, port, 'GET', f'/admin/api/tasks/{task_id}/count', admin_cookie)
+                polls += 1
+            except OSError:
+                pass
+        return polls
+
+    poll_tasks = [asyncio.ensure_future(poll_count()) for _ in range(pollers)]
+    started = time.perf_counter()
+    await asyncio.gather(*(one_checkin(cookie) for cookie in cookies))
+    elapsed = time.perf_counter() - started
+    done = True
+    polls = sum(await asyncio.gather(*poll_tasks))
+    return elapsed, sorted(latencies), statuses, polls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--students', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--pollers', type=int, default=10)
+    args = parser.parse_args()
+    if not os.environ.get('SECRET_KEY'):
+        sys.exit('SECRET_KEY must be set to the value the server uses')
+
+    task_id, code, cookies, admin_cookie = prepare(args.students)
+    elapsed, latencies, statuses, polls = asyncio.run(
+        run(args.url, code, task_id, cookies, admin_cookie, args.concurrency, args.pollers))
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    print(f'{len(latencies)} check-ins in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), '
+          f'concurrency {args.concurrency}')
+    print(f'latency ms: p50 {percentile(0.5):.1f}  p95 {percentile(0.95):.1f}  p99 {percentile(0.99):.1f}')
+    print(f'status codes: {statuses}')
+    print(f'live-count polls: {polls}')
+    print(f'recorded check-ins: {get_task_live_count(task_id)["checkin_count"]} / {len(cookies)}')
+
+
+if __name__ == '__main__':
+    main()
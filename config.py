@@ -6,3 +6,37 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or secrets_module.token_hex(32)
     DATABASE = 'checkin.db'
     FLASK_DEBUG = os.environ.get('FLASK_DEBUG', 'True') == 'True'
+    # Minimum number of consecutive missed tasks to flag a student
+    ABSENCE_ALERT_THRESHOLD = 3
+    # Attendance trend analytics
+    TREND_ROLLING_WEEKS = 4
+    AT_RISK_RECENT_TASKS = 5
+    AT_RISK_THRESHOLD = 60
+    # Maximum page size for the statistics JSON API
+    STATS_PAGE_MAX_LIMIT = 200
+    # Student search: page size and maximum number of results
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_RESULTS = 200
+    # Response compression
+    COMPRESS_MIN_SIZE = 1024
+    COMPRESS_MIMETYPES = ('text/html', 'text/csv', 'application/json')
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BROTLI_QUALITY = 4
+    # Task summaries frozen when a task closes: run the scheduler thread in this
+    # process, seconds to wait after end_time, and the maximum sleep between
+    # checks for tasks created by other processes
+    TASK_SUMMARY_SCHEDULER = os.environ.get('TASK_SUMMARY_SCHEDULER', 'True') == 'True'
+    TASK_SUMMARY_DELAY = 5
+    TASK_SUMMARY_POLL_INTERVAL = 60
+    # Asyncio service mode (async_app.py): listen address, threads for SQLite
+    # work and for requests passed to Flask, maximum queued jobs per pool
+    # before answering 503, and live-count long polling
+    ASYNC_HOST = os.environ.get('ASYNC_HOST', '127.0.0.1')
+    ASYNC_PORT = int(os.environ.get('ASYNC_PORT', '8000'))
+    ASYNC_BACKLOG = 4096
+    ASYNC_DB_WORKERS = 4
+    ASYNC_WSGI_WORKERS = 8
+    ASYNC_MAX_PENDING = 10000
+    ASYNC_MAX_BODY_SIZE = 6 * 1024 * 1024
+    ASYNC_LIVE_COUNT_TIMEOUT = 25
+    ASYNC_LIVE_POLL_INTERVAL = 0.5
@@ -1,7 +1,24 @@
 import sqlite3
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import bcrypt
 
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+
+def pinyin_key(name):
+    """Searchable pinyin for a name: full pinyin and initials, e.g. 'zhangsan zs'.
+    Empty when pypinyin is not installed"""
+    if lazy_pinyin is None or not name:
+        return ''
+    full = ''.join(lazy_pinyin(name))
+    initials = ''.join(lazy_pinyin(name, style=Style.FIRST_LETTER))
+    return f'{full} {initials}'
+
 
 def get_db_connection():
     """Get database connection"""
@@ -20,6 +37,160 @@ def verify_password(password, hashed):
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 
+# Data sets tracked in data_versions
+DATA_VERSION_NAMES = ('users', 'tasks', 'records', 'courses')
+
+
+def _bump_data_version(conn, name):
+    """Increment a data version counter inside the caller's transaction"""
+    conn.execute(
+        'UPDATE data_versions SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE name = ?',
+        (name,)
+    )
+
+
+def _get_data_version(conn, name):
+    """Get a single data version counter"""
+    return conn.execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()['version']
+
+
+def get_data_versions():
+    """Get current data version counters as a dict of name -> version"""
+    conn = get_db_connection()
+    rows = conn.execute('SELECT name, version FROM data_versions').fetchall()
+    conn.close()
+    return {row['name']: row['version'] for row in rows}
+
+
+def get_data_last_modified(now):
+    """Get the local time of the most recent change visible at now: either a
+    data write or a task starting/ending (which changes task status)"""
+    conn = get_db_connection()
+    row = conn.execute('''
+        SELECT MAX(changed_at) as last_modified FROM (
+            SELECT datetime(updated_at, 'localtime') as changed_at FROM data_versions
+            UNION ALL
+            SELECT start_time FROM checkin_tasks WHERE start_time <= ?
+            UNION ALL
+            SELECT end_time FROM checkin_tasks WHERE end_time <= ?
+        )
+    ''', (now, now)).fetchone()
+    conn.close()
+    return row['last_modified']
+
+
+class VersionedCache:
+    """Per-process LRU cache of query results keyed by a data version.
+
+    Versions live in the data_versions table and are bumped inside every
+    write transaction, so entries written by any worker process are
+    invalidated everywhere on the next lookup. Bounded both by number of
+    entries and by the total number of cached rows."""
+
+    def __init__(self, max_entries=32, max_rows=200000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entries = OrderedDict()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        """Get cached rows for key, or None if missing or stale"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, rows):
+        """Store rows for key, evicting least recently used entries"""
+        rows = tuple(rows)
+        if len(rows) > self.max_rows:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, rows)
+            self._rows += len(rows)
+            while len(self._entries) > self.max_entries or self._rows > self.max_rows:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def _remove(self, key):
+        version, rows = self._entries.pop(key)
+        self._rows -= len(rows)
+
+
+query_cache = VersionedCache()
+
+
+def cached_load(version_name, key, load):
+    """Call load(conn) for a list of rows, serving it from query_cache while
+    the named data version (or tuple of names) is unchanged"""
+    conn = get_db_connection()
+    try:
+        if isinstance(version_name, tuple):
+            version = tuple(_get_data_version(conn, name) for name in version_name)
+        else:
+            version = _get_data_version(conn, version_name)
+        rows = query_cache.get(key, version)
+        if rows is None:
+            rows = load(conn)
+            query_cache.put(key, version, rows)
+    finally:
+        conn.close()
+    return list(rows)
+
+
+def _cached_query(version_name, sql, params=()):
+    """Run a read query, serving it from query_cache while the named data version is unchanged"""
+    return cached_load(version_name, (sql, params), lambda conn: conn.execute(sql, params).fetchall())
+
+
+def _backfill_pinyin(cursor, only_missing=True):
+    """Compute users.pinyin for students (by default only those without one).
+    Returns the number of students updated"""
+    sql = "SELECT id, name FROM users WHERE role = 'student'"
+    if only_missing:
+        sql += " AND pinyin = ''"
+    updates = [(pinyin_key(row[1]), row[0]) for row in cursor.execute(sql).fetchall()]
+    cursor.executemany('UPDATE users SET pinyin = ? WHERE id = ?', updates)
+    return len(updates)
+
+
+def _fill_users_fts(cursor):
+    """Index every student in users_fts"""
+    cursor.execute('''
+        INSERT INTO users_fts (rowid, username, name, pinyin)
+        SELECT id, username, name, pinyin FROM users WHERE role = 'student'
+    ''')
+
+
+def rebuild_student_search():
+    """Recompute the pinyin of every student and rebuild users_fts, e.g. after
+    installing pypinyin. Returns the number of students"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    count = _backfill_pinyin(cursor, only_missing=False)
+    if _users_fts_available(conn):
+        cursor.execute('DELETE FROM users_fts')
+        _fill_users_fts(cursor)
+    # Search responses are cached per data version
+    _bump_data_version(conn, 'users')
+    conn.commit()
+    conn.close()
+    return count
+
+
 def init_db():
     """Initialize database with tables and admin user"""
     conn = get_db_connection()
@@ -33,10 +204,17 @@ def init_db():
             password TEXT NOT NULL,
             name TEXT NOT NULL,
             role TEXT NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            pinyin TEXT NOT NULL DEFAULT ''
         )
     ''')
     
+    # Databases created before student search lack users.pinyin
+    user_columns = [row['name'] for row in cursor.execute('PRAGMA table_info(users)')]
+    if 'pinyin' not in user_columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN pinyin TEXT NOT NULL DEFAULT ''")
+        _backfill_pinyin(cursor)
+    
     # Create checkin_tasks table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS checkin_tasks (
@@ -47,10 +225,42 @@ def init_db():
             end_time TIMESTAMP NOT NULL,
             created_by INTEGER NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            course_id INTEGER,
+            FOREIGN KEY (created_by) REFERENCES users(id),
+            FOREIGN KEY (course_id) REFERENCES courses(id)
+        )
+    ''')
+    
+    # Databases created before courses existed lack checkin_tasks.course_id
+    task_columns = [row['name'] for row in cursor.execute('PRAGMA table_info(checkin_tasks)')]
+    if 'course_id' not in task_columns:
+        cursor.execute('ALTER TABLE checkin_tasks ADD COLUMN course_id INTEGER REFERENCES courses(id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkin_tasks_course ON checkin_tasks(course_id)')
+    
+    # Create courses table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_by INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (created_by) REFERENCES users(id)
         )
     ''')
     
+    # Create course_enrollments table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS course_enrollments (
+            course_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (course_id, user_id),
+            FOREIGN KEY (course_id) REFERENCES courses(id),
+            FOREIGN KEY (user_id) REFERENCES users(id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_course_enrollments_user ON course_enrollments(user_id)')
+    
     # Create checkin_records table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS checkin_records (
@@ -64,6 +274,77 @@ def init_db():
         )
     ''')
     
+    # Index for per-student lookups (the UNIQUE constraint covers task_id first)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_checkin_records_user ON checkin_records(user_id)')
+    
+    # Create users_fts: trigram full-text index over student username/name/pinyin,
+    # kept in sync with users by triggers. Requires SQLite 3.34+ built with FTS5;
+    # search falls back to LIKE scans without it
+    fts_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+    ).fetchone()
+    if not fts_exists:
+        try:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE users_fts USING fts5(username, name, pinyin, tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            print('FTS5 trigram tokenizer unavailable, student search will use LIKE')
+        else:
+            _fill_users_fts(cursor)
+            fts_exists = True
+    if fts_exists:
+        # The triggers copy users.pinyin, which is computed in Python on insert,
+        # so they work from any connection. Recreated on every start to replace
+        # older triggers that called a per-connection SQL function
+        cursor.executescript('''
+            DROP TRIGGER IF EXISTS users_fts_insert;
+            DROP TRIGGER IF EXISTS users_fts_delete;
+            DROP TRIGGER IF EXISTS users_fts_update;
+            CREATE TRIGGER users_fts_insert AFTER INSERT ON users
+            WHEN new.role = 'student' BEGIN
+                INSERT INTO users_fts (rowid, username, name, pinyin)
+                VALUES (new.id, new.username, new.name, new.pinyin);
+            END;
+            CREATE TRIGGER users_fts_delete AFTER DELETE ON users BEGIN
+                DELETE FROM users_fts WHERE rowid = old.id;
+            END;
+            CREATE TRIGGER users_fts_update AFTER UPDATE OF username, name, role, pinyin ON users BEGIN
+                DELETE FROM users_fts WHERE rowid = old.id;
+                INSERT INTO users_fts (rowid, username, name, pinyin)
+                SELECT new.id, new.username, new.name, new.pinyin
+                WHERE new.role = 'student';
+            END;
+        ''')
+    
+    # Create task_summaries table: results of a task frozen once its window has
+    # closed (see task_summaries.py). absent_students and latency_histogram are JSON
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_summaries (
+            task_id INTEGER PRIMARY KEY,
+            roster_size INTEGER NOT NULL,
+            checkin_count INTEGER NOT NULL,
+            absent_students TEXT NOT NULL,
+            latency_histogram TEXT NOT NULL,
+            csv_content TEXT NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (task_id) REFERENCES checkin_tasks(id)
+        )
+    ''')
+    
+    # Create data_versions table: one counter per data set, bumped on writes
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.executemany(
+        'INSERT OR IGNORE INTO data_versions (name) VALUES (?)',
+        [(name,) for name in DATA_VERSION_NAMES]
+    )
+    
     # Check if admin user exists
     cursor.execute('SELECT id FROM users WHERE username = ?', ('admin',))
     if not cursor.fetchone():
@@ -98,9 +379,10 @@ def create_user(username, password, name, role='student'):
     try:
         hashed_pw = hash_password(password)
         conn.execute(
-            'INSERT INTO users (username, password, name, role) VALUES (?, ?, ?, ?)',
-            (username, hashed_pw, name, role)
+            'INSERT INTO users (username, password, name, role, pinyin) VALUES (?, ?, ?, ?, ?)',
+            (username, hashed_pw, name, role, pinyin_key(name))
         )
+        _bump_data_version(conn, 'users')
         conn.commit()
         conn.close()
         return True
@@ -109,15 +391,16 @@ def create_user(username, password, name, role='student'):
         return False
 
 
-def create_checkin_task(title, code, start_time, end_time, created_by):
-    """Create a new checkin task"""
+def create_checkin_task(title, code, start_time, end_time, created_by, course_id=None):
+    """Create a new checkin task. Tasks without a course are for all students"""
     conn = get_db_connection()
     try:
         cursor = conn.execute(
-            'INSERT INTO checkin_tasks (title, code, start_time, end_time, created_by) VALUES (?, ?, ?, ?, ?)',
-            (title, code, start_time, end_time, created_by)
+            'INSERT INTO checkin_tasks (title, code, start_time, end_time, created_by, course_id) VALUES (?, ?, ?, ?, ?, ?)',
+            (title, code, start_time, end_time, created_by, course_id)
         )
         task_id = cursor.lastrowid
+        _bump_data_version(conn, 'tasks')
         conn.commit()
         conn.close()
         return task_id
@@ -126,16 +409,6 @@ def create_checkin_task(title, code, start_time, end_time, created_by):
         return None
 
 
-def get_all_checkin_tasks():
-    """Get all checkin tasks"""
-    conn = get_db_connection()
-    tasks = conn.execute(
-        'SELECT * FROM checkin_tasks ORDER BY created_at DESC'
-    ).fetchall()
-    conn.close()
-    return tasks
-
-
 def get_checkin_task_by_id(task_id):
     """Get checkin task by ID"""
     conn = get_db_connection()
@@ -160,6 +433,7 @@ def create_checkin_record(task_id, user_id):
             'INSERT INTO checkin_records (task_id, user_id) VALUES (?, ?)',
             (task_id, user_id)
         )
+        _bump_data_version(conn, 'records')
         conn.commit()
         conn.close()
         return True
@@ -168,20 +442,6 @@ def create_checkin_record(task_id, user_id):
         return False
 
 
-def get_checkin_records_by_task(task_id):
-    """Get all checkin records for a task"""
-    conn = get_db_connection()
-    records = conn.execute('''
-        SELECT cr.*, u.username, u.name 
-        FROM checkin_records cr
-        JOIN users u ON cr.user_id = u.id
-        WHERE cr.task_id = ?
-        ORDER BY cr.checkin_time DESC
-    ''', (task_id,)).fetchall()
-    conn.close()
-    return records
-
-
 def has_checked_in(task_id, user_id):
     """Check if user has checked in for a task"""
     conn = get_db_connection()
@@ -193,93 +453,281 @@ def has_checked_in(task_id, user_id):
     return record is not None
 
 
-def get_all_students():
-    """Get all students"""
+def is_on_task_roster(task, user_id):
+    """Check if a student is expected to check in for a task"""
+    if task['course_id'] is None:
+        return True
     conn = get_db_connection()
-    students = conn.execute(
-        'SELECT * FROM users WHERE role = ? ORDER BY username',
-        ('student',)
-    ).fetchall()
+    row = conn.execute(
+        'SELECT 1 FROM course_enrollments WHERE course_id = ? AND user_id = ?',
+        (task['course_id'], user_id)
+    ).fetchone()
     conn.close()
-    return students
+    return row is not None
+
+
+def create_course(name, created_by):
+    """Create a new course"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(
+            'INSERT INTO courses (name, created_by) VALUES (?, ?)',
+            (name, created_by)
+        )
+        course_id = cursor.lastrowid
+        _bump_data_version(conn, 'courses')
+        conn.commit()
+        conn.close()
+        return course_id
+    except sqlite3.IntegrityError:
+        conn.close()
+        return None
+
+
+def get_all_courses():
+    """Get all courses with enrollment and task counts"""
+    return _cached_query(('courses', 'tasks'), '''
+        SELECT c.*,
+               (SELECT COUNT(*) FROM course_enrollments e WHERE e.course_id = c.id) as student_count,
+               (SELECT COUNT(*) FROM checkin_tasks t WHERE t.course_id = c.id) as task_count
+        FROM courses c
+        ORDER BY c.name
+    ''')
 
 
-def get_student_attendance_stats():
-    """Get attendance statistics for all students"""
+def get_course_by_id(course_id):
+    """Get course by ID"""
+    conn = get_db_connection()
+    course = conn.execute('SELECT * FROM courses WHERE id = ?', (course_id,)).fetchone()
+    conn.close()
+    return course
+
+
+def get_course_students(course_id):
+    """Get students enrolled in a course"""
+    return _cached_query(('courses', 'users'), '''
+        SELECT u.*, e.enrolled_at
+        FROM course_enrollments e
+        JOIN users u ON u.id = e.user_id
+        WHERE e.course_id = ?
+        ORDER BY u.username
+    ''', (course_id,))
+
+
+def enroll_students(course_id, usernames):
+    """Enroll students in a course by 学号.
+    Returns a dict with success_count, skip_count, and errors list"""
     conn = get_db_connection()
     
-    # Get total number of tasks
-    total_tasks = conn.execute('SELECT COUNT(*) as count FROM checkin_tasks').fetchone()['count']
+    success_count = 0
+    skip_count = 0
+    errors = []
     
-    # Get students with their check-in counts
-    rows = conn.execute('''
-        SELECT u.id, u.username, u.name,
-               COUNT(cr.id) as checkin_count,
-               CAST(COUNT(cr.id) AS FLOAT) / NULLIF(?, 0) * 100 as attendance_rate
-        FROM users u
-        LEFT JOIN checkin_records cr ON u.id = cr.user_id
-        WHERE u.role = ?
-        GROUP BY u.id, u.username, u.name
-        ORDER BY checkin_count DESC
-    ''', (total_tasks, 'student')).fetchall()
+    for username in usernames:
+        user = conn.execute(
+            'SELECT id FROM users WHERE username = ? AND role = ?',
+            (username, 'student')
+        ).fetchone()
+        if not user:
+            errors.append(f'学号 {username}: 学生不存在')
+            continue
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO course_enrollments (course_id, user_id) VALUES (?, ?)',
+            (course_id, user['id'])
+        )
+        if cursor.rowcount:
+            success_count += 1
+        else:
+            skip_count += 1
     
+    if success_count:
+        _bump_data_version(conn, 'courses')
+    conn.commit()
     conn.close()
-    # Convert Row objects to dictionaries
-    return [dict(row) for row in rows]
+    
+    return {
+        'success_count': success_count,
+        'skip_count': skip_count,
+        'errors': errors
+    }
 
 
-def get_task_attendance_stats():
-    """Get check-in statistics for all tasks"""
+def unenroll_student(course_id, user_id):
+    """Remove a student from a course"""
     conn = get_db_connection()
-    
-    # Get total number of students
-    total_students = conn.execute('SELECT COUNT(*) as count FROM users WHERE role = ?', ('student',)).fetchone()['count']
-    
-    # Get tasks with their check-in counts
-    rows = conn.execute('''
-        SELECT t.id, t.title, t.start_time, t.end_time, t.created_at,
-               COUNT(cr.id) as checkin_count,
-               CAST(COUNT(cr.id) AS FLOAT) / NULLIF(?, 0) * 100 as checkin_rate
+    cursor = conn.execute(
+        'DELETE FROM course_enrollments WHERE course_id = ? AND user_id = ?',
+        (course_id, user_id)
+    )
+    removed = cursor.rowcount > 0
+    if removed:
+        _bump_data_version(conn, 'courses')
+    conn.commit()
+    conn.close()
+    return removed
+
+
+# A check-in record cr of task t counts only while its student is on the task's
+# roster (all students for tasks without a course, enrolled students otherwise),
+# so that check-ins of students who left the course match the roster size
+ON_TASK_ROSTER = ('''(t.course_id IS NULL OR EXISTS (
+    SELECT 1 FROM course_enrollments e WHERE e.course_id = t.course_id AND e.user_id = cr.user_id))''')
+
+# Check-ins of task t by students on its roster
+ROSTER_CHECKIN_COUNT = f'(SELECT COUNT(*) FROM checkin_records cr WHERE cr.task_id = t.id AND {ON_TASK_ROSTER})'
+
+# Check-in count and roster size of task t: frozen in task_summaries (alias s)
+# once the task has closed, counted live by the same roster rule while it is
+# still open, so that freezing a task does not change its figures
+TASK_CHECKIN_COUNT = f'COALESCE(s.checkin_count, {ROSTER_CHECKIN_COUNT})'
+TASK_ROSTER_SIZE = '''COALESCE(s.roster_size, CASE WHEN t.course_id IS NULL
+    THEN (SELECT COUNT(*) FROM users WHERE role = 'student')
+    ELSE (SELECT COUNT(*) FROM course_enrollments e WHERE e.course_id = t.course_id) END)'''
+
+
+def get_task_live_count(task_id):
+    """Get the current check-in count and roster size of a task"""
+    conn = get_db_connection()
+    row = conn.execute(f'''
+        SELECT t.id as task_id, t.start_time, t.end_time,
+               {TASK_CHECKIN_COUNT} as checkin_count,
+               {TASK_ROSTER_SIZE} as roster_size
         FROM checkin_tasks t
-        LEFT JOIN checkin_records cr ON t.id = cr.task_id
-        GROUP BY t.id, t.title, t.start_time, t.end_time, t.created_at
-        ORDER BY t.created_at DESC
-    ''', (total_students,)).fetchall()
-    
+        LEFT JOIN task_summaries s ON s.task_id = t.id
+        WHERE t.id = ?
+    ''', (task_id,)).fetchone()
+    conn.close()
+    return dict(row) if row else None
+
+
+def get_task_summary(task_id):
+    """Get the frozen summary of a closed task, or None if not computed yet"""
+    conn = get_db_connection()
+    summary = conn.execute('SELECT * FROM task_summaries WHERE task_id = ?', (task_id,)).fetchone()
+    conn.close()
+    return summary
+
+
+def save_task_summary(task_id, roster_size, checkin_count, absent_students, latency_histogram, csv_content):
+    """Store a task summary. Returns False if one was already stored (e.g. by another worker)"""
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        INSERT OR IGNORE INTO task_summaries
+            (task_id, roster_size, checkin_count, absent_students, latency_histogram, csv_content)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (task_id, roster_size, checkin_count, absent_students, latency_histogram, csv_content))
+    saved = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return saved
+
+
+def get_unsummarized_tasks(ended_before):
+    """Get tasks that ended before the given time and have no summary yet"""
+    conn = get_db_connection()
+    tasks = conn.execute('''
+        SELECT t.* FROM checkin_tasks t
+        LEFT JOIN task_summaries s ON s.task_id = t.id
+        WHERE t.end_time < ? AND s.task_id IS NULL
+        ORDER BY t.end_time
+    ''', (ended_before,)).fetchall()
     conn.close()
-    # Convert Row objects to dictionaries
-    return [dict(row) for row in rows]
+    return tasks
 
 
-def get_overall_stats():
-    """Get overall statistics"""
+def get_pending_task_end_times(now):
+    """Get the end times of tasks that have not ended yet"""
     conn = get_db_connection()
+    rows = conn.execute('SELECT end_time FROM checkin_tasks WHERE end_time >= ?', (now,)).fetchall()
+    conn.close()
+    return [row['end_time'] for row in rows]
+
+
+def _stats_scope(conn, course_id=None):
+    """SQL fragments scoping statistics to one course, or to the whole deployment.
     
-    # Total students
-    total_students = conn.execute('SELECT COUNT(*) as count FROM users WHERE role = ?', ('student',)).fetchone()['count']
+    Tasks without a course are expected of every student; course tasks only of
+    the students enrolled in that course. Fragments expect the aliases u (users),
+    t (checkin_tasks) and cr (checkin_records)."""
+    if course_id is None:
+        total_students = conn.execute('SELECT COUNT(*) as count FROM users WHERE role = ?', ('student',)).fetchone()['count']
+        total_tasks = conn.execute('SELECT COUNT(*) as count FROM checkin_tasks').fetchone()['count']
+        open_tasks = conn.execute('SELECT COUNT(*) as count FROM checkin_tasks WHERE course_id IS NULL').fetchone()['count']
+        return {
+            'total_students': total_students,
+            'total_tasks': total_tasks,
+            'student_filter': ('u.role = ?', ['student']),
+            # Only check-ins for tasks the student is expected to attend, so that
+            # check-ins kept after leaving a course do not offset absences
+            'record_join': ('''cr.user_id = u.id AND cr.task_id IN (
+                                  SELECT id FROM checkin_tasks WHERE course_id IS NULL
+                                  OR course_id IN (SELECT course_id FROM course_enrollments WHERE user_id = u.id))''', []),
+            'task_filter': ('1 = 1', []),
+            'expected_tasks': ('''(? + (SELECT COUNT(*) FROM course_enrollments e
+                                      JOIN checkin_tasks et ON et.course_id = e.course_id
+                                      WHERE e.user_id = u.id))''', [open_tasks]),
+            'roster_size': ('''(CASE WHEN t.course_id IS NULL THEN ?
+                                ELSE (SELECT COUNT(*) FROM course_enrollments e WHERE e.course_id = t.course_id) END)''',
+                            [total_students])
+        }
     
-    # Total tasks
-    total_tasks = conn.execute('SELECT COUNT(*) as count FROM checkin_tasks').fetchone()['count']
+    total_students = conn.execute(
+        'SELECT COUNT(*) as count FROM course_enrollments WHERE course_id = ?', (course_id,)
+    ).fetchone()['count']
+    total_tasks = conn.execute(
+        'SELECT COUNT(*) as count FROM checkin_tasks WHERE course_id = ?', (course_id,)
+    ).fetchone()['count']
+    return {
+        'total_students': total_students,
+        'total_tasks': total_tasks,
+        'student_filter': ('u.id IN (SELECT user_id FROM course_enrollments WHERE course_id = ?)', [course_id]),
+        'record_join': ('cr.user_id = u.id AND cr.task_id IN (SELECT id FROM checkin_tasks WHERE course_id = ?)', [course_id]),
+        'task_filter': ('t.course_id = ?', [course_id]),
+        'expected_tasks': ('?', [total_tasks]),
+        'roster_size': ('?', [total_students])
+    }
+
+
+def get_overall_stats(course_id=None):
+    """Get overall statistics for the whole deployment or one course"""
+    conn = get_db_connection()
+    scope = _stats_scope(conn, course_id)
+    student_filter, student_params = scope['student_filter']
+    record_join, record_params = scope['record_join']
+    task_filter, task_params = scope['task_filter']
+    expected_tasks, expected_params = scope['expected_tasks']
+    roster_size, roster_params = scope['roster_size']
+    
+    # Total students and tasks in scope
+    total_students = scope['total_students']
+    total_tasks = scope['total_tasks']
     
-    # Total check-ins
-    total_checkins = conn.execute('SELECT COUNT(*) as count FROM checkin_records').fetchone()['count']
+    # Total check-ins, and possible check-ins: each task counts once per student on its roster
+    totals = conn.execute(f'''
+        SELECT COALESCE(SUM({TASK_CHECKIN_COUNT}), 0) as checkins,
+               COALESCE(SUM(COALESCE(s.roster_size, {roster_size})), 0) as possible
+        FROM checkin_tasks t
+        LEFT JOIN task_summaries s ON s.task_id = t.id
+        WHERE {task_filter}
+    ''', roster_params + task_params).fetchone()
+    total_checkins = totals['checkins']
+    total_possible = totals['possible']
     
     # Calculate overall attendance rate
-    total_possible = total_students * total_tasks
     overall_rate = (total_checkins / total_possible * 100) if total_possible > 0 else 0
     
     # Get top absent students (most missed check-ins)
-    absent_rows = conn.execute('''
+    absent_rows = conn.execute(f'''
         SELECT u.id, u.username, u.name,
-               (? - COUNT(cr.id)) as absent_count
+               ({expected_tasks} - COUNT(cr.id)) as absent_count
         FROM users u
-        LEFT JOIN checkin_records cr ON u.id = cr.user_id
-        WHERE u.role = ?
+        LEFT JOIN checkin_records cr ON {record_join}
+        WHERE {student_filter}
         GROUP BY u.id, u.username, u.name
         HAVING absent_count > 0
         ORDER BY absent_count DESC
         LIMIT 10
-    ''', (total_tasks, 'student')).fetchall()
+    ''', expected_params + record_params + student_params).fetchall()
     
     conn.close()
     
@@ -293,6 +741,178 @@ def get_overall_stats():
     }
 
 
+# Sortable columns for the paginated statistics queries
+STUDENT_STATS_SORT_COLUMNS = ('username', 'name', 'checkin_count')
+TASK_STATS_SORT_COLUMNS = ('created_at', 'start_time', 'title', 'checkin_count')
+
+
+def _like_pattern(text, prefix=False):
+    """Build a LIKE substring (or prefix) pattern with wildcards escaped"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'{escaped}%' if prefix else f'%{escaped}%'
+
+
+# Shorter queries cannot use the trigram index
+FTS_MIN_QUERY_LENGTH = 3
+
+_has_users_fts = None
+
+
+def _users_fts_available(conn):
+    """Whether the users_fts index exists (cached once found)"""
+    global _has_users_fts
+    if not _has_users_fts:
+        _has_users_fts = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+        ).fetchone() is not None
+    return _has_users_fts
+
+
+def _student_search_clause(conn, query, alias='u'):
+    """SQL condition (and params) restricting alias.id to students matching query
+    by 学号, name or pinyin"""
+    if not _users_fts_available(conn):
+        pattern = _like_pattern(query)
+        return f"({alias}.username LIKE ? ESCAPE '\\' OR {alias}.name LIKE ? ESCAPE '\\')", [pattern, pattern]
+    if len(query) >= FTS_MIN_QUERY_LENGTH:
+        phrase = '"' + query.replace('"', '""') + '"'
+        return f'{alias}.id IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ?)', [phrase]
+    # Unary + keeps SQLite from using the trigram index for short LIKE
+    # patterns, which it cannot answer reliably
+    pattern = _like_pattern(query)
+    return (f"{alias}.id IN (SELECT rowid FROM users_fts WHERE +username LIKE ? ESCAPE '\\' "
+            f"OR +name LIKE ? ESCAPE '\\' OR +pinyin LIKE ? ESCAPE '\\')"), [pattern] * 3
+
+
+def search_students(query, limit=20, offset=0):
+    """Search students by 学号, name or pinyin (substring match).
+    Returns (rows, has_more)"""
+    conn = get_db_connection()
+    condition, params = _student_search_clause(conn, query)
+    rows = conn.execute(f'''
+        SELECT u.id, u.username, u.name
+        FROM users u
+        WHERE u.role = ? AND {condition}
+        ORDER BY u.username LIKE ? ESCAPE '\\' DESC, u.username
+        LIMIT ? OFFSET ?
+    ''', ['student'] + params + [_like_pattern(query, prefix=True), limit + 1, offset]).fetchall()
+    conn.close()
+    return [dict(row) for row in rows[:limit]], len(rows) > limit
+
+
+def search_student_ids(query):
+    """Ids of all students matching query, for filtering student lists"""
+    conn = get_db_connection()
+    condition, params = _student_search_clause(conn, query)
+    ids = {row[0] for row in conn.execute(
+        f'SELECT u.id FROM users u WHERE u.role = ? AND {condition}',
+        ['student'] + params
+    )}
+    conn.close()
+    return ids
+
+
+def _keyset_clause(sort, descending, after):
+    """WHERE/ORDER BY fragments for keyset pagination on (sort, id)"""
+    if descending:
+        where = f'WHERE ({sort}, id) < (?, ?)' if after else ''
+        order = f'ORDER BY {sort} DESC, id DESC'
+    else:
+        where = f'WHERE ({sort}, id) > (?, ?)' if after else ''
+        order = f'ORDER BY {sort}, id'
+    return where, order
+
+
+def get_student_stats_page(sort='username', descending=False, limit=50, after=None, query=None, course_id=None):
+    """Get one page of student attendance statistics, optionally for one course.
+    after is the (sort value, id) of the last row of the previous page.
+    Returns (rows, has_more, total)"""
+    if sort not in STUDENT_STATS_SORT_COLUMNS:
+        raise ValueError(f'Unsupported sort column: {sort}')
+    
+    conn = get_db_connection()
+    scope = _stats_scope(conn, course_id)
+    student_filter, student_params = scope['student_filter']
+    record_join, record_params = scope['record_join']
+    expected_tasks, expected_params = scope['expected_tasks']
+    
+    filter_sql = ''
+    filter_params = []
+    if query:
+        condition, filter_params = _student_search_clause(conn, query)
+        filter_sql = f'AND {condition}'
+    
+    total = conn.execute(
+        f'SELECT COUNT(*) as count FROM users u WHERE {student_filter} {filter_sql}',
+        student_params + filter_params
+    ).fetchone()['count']
+    
+    where, order = _keyset_clause(sort, descending, after)
+    rows = conn.execute(f'''
+        SELECT id, username, name, checkin_count, expected_tasks,
+               CAST(checkin_count AS FLOAT) / NULLIF(expected_tasks, 0) * 100 as attendance_rate
+        FROM (
+            SELECT u.id, u.username, u.name,
+                   COUNT(cr.id) as checkin_count,
+                   {expected_tasks} as expected_tasks
+            FROM users u
+            LEFT JOIN checkin_records cr ON {record_join}
+            WHERE {student_filter} {filter_sql}
+            GROUP BY u.id, u.username, u.name
+        )
+        {where}
+        {order}
+        LIMIT ?
+    ''', expected_params + record_params + student_params + filter_params + list(after or []) + [limit + 1]).fetchall()
+    
+    conn.close()
+    return [dict(row) for row in rows[:limit]], len(rows) > limit, total
+
+
+def get_task_stats_page(sort='created_at', descending=True, limit=50, after=None, query=None, course_id=None):
+    """Get one page of task check-in statistics, optionally for one course.
+    after is the (sort value, id) of the last row of the previous page.
+    Returns (rows, has_more, total)"""
+    if sort not in TASK_STATS_SORT_COLUMNS:
+        raise ValueError(f'Unsupported sort column: {sort}')
+    
+    conn = get_db_connection()
+    scope = _stats_scope(conn, course_id)
+    task_filter, task_params = scope['task_filter']
+    roster_size, roster_params = scope['roster_size']
+    
+    filter_sql = ''
+    filter_params = []
+    if query:
+        filter_sql = "AND t.title LIKE ? ESCAPE '\\'"
+        filter_params = [_like_pattern(query)]
+    
+    total = conn.execute(
+        f'SELECT COUNT(*) as count FROM checkin_tasks t WHERE {task_filter} {filter_sql}',
+        task_params + filter_params
+    ).fetchone()['count']
+    
+    where, order = _keyset_clause(sort, descending, after)
+    rows = conn.execute(f'''
+        SELECT id, title, start_time, end_time, created_at, course_id, checkin_count, roster_size,
+               CAST(checkin_count AS FLOAT) / NULLIF(roster_size, 0) * 100 as checkin_rate
+        FROM (
+            SELECT t.id, t.title, t.start_time, t.end_time, t.created_at, t.course_id,
+                   {TASK_CHECKIN_COUNT} as checkin_count,
+                   COALESCE(s.roster_size, {roster_size}) as roster_size
+            FROM checkin_tasks t
+            LEFT JOIN task_summaries s ON s.task_id = t.id
+            WHERE {task_filter} {filter_sql}
+        )
+        {where}
+        {order}
+        LIMIT ?
+    ''', roster_params + task_params + filter_params + list(after or []) + [limit + 1]).fetchall()
+    
+    conn.close()
+    return [dict(row) for row in rows[:limit]], len(rows) > limit, total
+
+
 def bulk_create_users(users_data):
     """Bulk create users from a list of tuples (username, password, name)
     Returns a dict with success_count, skip_count, and errors list"""
@@ -314,13 +934,15 @@ def bulk_create_users(users_data):
             # Hash password and insert
             hashed_pw = hash_password(password)
             cursor.execute(
-                'INSERT INTO users (username, password, name, role) VALUES (?, ?, ?, ?)',
-                (username, hashed_pw, name, 'student')
+                'INSERT INTO users (username, password, name, role, pinyin) VALUES (?, ?, ?, ?, ?)',
+                (username, hashed_pw, name, 'student', pinyin_key(name))
             )
             success_count += 1
         except Exception as e:
             errors.append(f'学号 {username}: {str(e)}')
     
+    if success_count:
+        _bump_data_version(conn, 'users')
     conn.commit()
     conn.close()
     
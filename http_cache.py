@@ -0,0 +1,230 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from datetime import datetime
+from functools import wraps
+
+from flask import request, session, send_from_directory, jsonify, Response, current_app
+
+from database import get_data_versions, get_data_last_modified
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Fingerprinted static names look like css/style.0123456789.css
+FINGERPRINT_RE = re.compile(r'^(?P<stem>.+)\.(?P<digest>[0-9a-f]{10})(?P<ext>\.[^./]+)$')
+
+# Static files served for a year once fingerprinted
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Precompressed variants, in order of preference
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+class StaticManifest:
+    """Content hashes of static files, recomputed when a file changes"""
+
+    def __init__(self, static_folder):
+        self.static_folder = static_folder
+        self._digests = {}
+
+    def digest(self, filename):
+        """Short content hash of a static file, or None if it does not exist"""
+        path = os.path.join(self.static_folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        cached = self._digests.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()[:10]
+        self._digests[filename] = (mtime, digest)
+        return digest
+
+    def fingerprint(self, filename):
+        """Map css/style.css to css/style.<digest>.css"""
+        digest = self.digest(filename)
+        if digest is None:
+            return filename
+        stem, ext = os.path.splitext(filename)
+        return f'{stem}.{digest}{ext}'
+
+    def resolve(self, filename):
+        """Map a fingerprinted name back to the real file.
+        Returns (filename, immutable)"""
+        match = FINGERPRINT_RE.match(filename)
+        if match:
+            original = match.group('stem') + match.group('ext')
+            if self.digest(original) == match.group('digest'):
+                return original, True
+        return filename, False
+
+
+def _accepted_encodings():
+    return {value.lower() for value, quality in request.accept_encodings if quality > 0}
+
+
+def _precompressed_variant(static_folder, filename):
+    """Pick a precompressed file the client accepts and that is not older than the original"""
+    accepted = _accepted_encodings()
+    original = os.path.join(static_folder, filename)
+    for encoding, suffix in PRECOMPRESSED_ENCODINGS:
+        if encoding not in accepted:
+            continue
+        try:
+            if os.stat(original + suffix).st_mtime >= os.stat(original).st_mtime:
+                return encoding, filename + suffix
+        except OSError:
+            continue
+    return None, None
+
+
+def _make_static_view(app, manifest):
+    def static(filename):
+        """Serve static files, with long-lived caching for fingerprinted names"""
+        filename, immutable = manifest.resolve(filename)
+        max_age = IMMUTABLE_MAX_AGE if immutable else None
+
+        encoding, compressed = _precompressed_variant(app.static_folder, filename)
+        if encoding:
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            response = send_from_directory(app.static_folder, compressed, max_age=max_age, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(app.static_folder, filename, max_age=max_age)
+
+        response.vary.add('Accept-Encoding')
+        if immutable:
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+        return response
+    return static
+
+
+def _compress_response(response):
+    """Compress text responses above the configured size threshold"""
+    config = current_app.config
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in config['COMPRESS_MIMETYPES']):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    accepted = _accepted_encodings()
+    if brotli is not None and 'br' in accepted:
+        response.set_data(brotli.compress(body, quality=config['COMPRESS_BROTLI_QUALITY']))
+        response.headers['Content-Encoding'] = 'br'
+    elif 'gzip' in accepted:
+        response.set_data(gzip.compress(body, compresslevel=config['COMPRESS_GZIP_LEVEL']))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def precompress_static(static_folder, extensions=('.js', '.css')):
+    """Write .gz (and .br when brotli is installed) next to static files.
+    Returns the list of files written"""
+    written = []
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(extensions):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            variants = [('.gz', gzip.compress(data, compresslevel=9))]
+            if brotli is not None:
+                variants.append(('.br', brotli.compress(data, quality=11)))
+            for suffix, compressed in variants:
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written.append(path + suffix)
+    return written
+
+
+def init_app(app):
+    """Install fingerprinted static serving and response compression"""
+    manifest = StaticManifest(app.static_folder)
+
+    @app.url_defaults
+    def fingerprint_static_urls(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.fingerprint(values['filename'])
+
+    app.view_functions['static'] = _make_static_view(app, manifest)
+    app.after_request(_compress_response)
+
+    @app.cli.command('precompress-static')
+    def precompress_static_command():
+        """Generate .gz/.br files for static assets"""
+        for path in precompress_static(app.static_folder):
+            print(path)
+
+
+def _version_key():
+    versions = get_data_versions()
+    return ','.join(f'{name}={versions[name]}' for name in sorted(versions))
+
+
+def versioned_json(build_payload):
+    """Return build_payload() as JSON with an ETag derived from the data versions.
+    Answers 304 without building the payload when the client copy is current"""
+    etag = hashlib.sha1(f'{request.full_path}|{_version_key()}'.encode('utf-8')).hexdigest()
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build_payload())
+    # Weak, since the body may be served with different content encodings
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def conditional_page(f):
+    """Add ETag/Last-Modified to a page that only depends on stored data,
+    the task schedule and the logged-in user, and answer 304 when unchanged"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Pending flash messages are rendered into the page, so never reuse it
+        if session.get('_flashes'):
+            return f(*args, **kwargs)
+
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        last_modified = get_data_last_modified(now)
+        etag = hashlib.sha1(
+            f'{request.full_path}|{session.get("user_id")}|{_version_key()}|{last_modified}'.encode('utf-8')
+        ).hexdigest()
+        last_modified_at = datetime.strptime(last_modified, '%Y-%m-%d %H:%M:%S').astimezone() if last_modified else None
+
+        if request.if_none_match:
+            unchanged = request.if_none_match.contains_weak(etag)
+        else:
+            unchanged = (last_modified_at is not None
+                         and request.if_modified_since is not None
+                         and last_modified_at <= request.if_modified_since)
+
+        if unchanged:
+            response = Response(status=304)
+        else:
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified_at
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response
+    return decorated_function
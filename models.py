@@ -1,8 +1,17 @@
 from datetime import datetime
 
 
+def current_time():
+    """Current local time in the format stored in the database"""
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
 class User:
     """User model"""
+    __slots__ = ('id', 'username', 'password', 'name', 'role', 'created_at')
+    # Constructor argument order, for building objects from cursor tuples
+    COLUMNS = __slots__
+    
     def __init__(self, id, username, password, name, role, created_at):
         self.id = id
         self.username = username
@@ -32,7 +41,11 @@ class User:
 
 class CheckinTask:
     """Checkin task model"""
-    def __init__(self, id, title, code, start_time, end_time, created_by, created_at):
+    __slots__ = ('id', 'title', 'code', 'start_time', 'end_time', 'created_by', 'created_at', 'course_id')
+    # Constructor argument order, for building objects from cursor tuples
+    COLUMNS = __slots__
+    
+    def __init__(self, id, title, code, start_time, end_time, created_by, created_at, course_id=None):
         self.id = id
         self.title = title
         self.code = code
@@ -40,6 +53,8 @@ class CheckinTask:
         self.end_time = end_time
         self.created_by = created_by
         self.created_at = created_at
+        # None means the task is for all students
+        self.course_id = course_id
     
     @staticmethod
     def from_row(row):
@@ -53,17 +68,23 @@ class CheckinTask:
             row['start_time'],
             row['end_time'],
             row['created_by'],
-            row['created_at']
+            row['created_at'],
+            row['course_id']
         )
     
-    def is_active(self):
+    def is_active(self, now=None):
         """Check if task is currently active"""
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if now is None:
+            now = current_time()
         return self.start_time <= now <= self.end_time
 
 
 class CheckinRecord:
     """Checkin record model"""
+    __slots__ = ('id', 'task_id', 'user_id', 'checkin_time')
+    # Constructor argument order, for building objects from cursor tuples
+    COLUMNS = __slots__
+    
     def __init__(self, id, task_id, user_id, checkin_time):
         self.id = id
         self.task_id = task_id
@@ -81,3 +102,59 @@ class CheckinRecord:
             row['user_id'],
             row['checkin_time']
         )
+
+
+class Course:
+    """Course model"""
+    __slots__ = ('id', 'name', 'created_by', 'created_at')
+    # Constructor argument order, for building objects from cursor tuples
+    COLUMNS = __slots__
+    
+    def __init__(self, id, name, created_by, created_at):
+        self.id = id
+        self.name = name
+        self.created_by = created_by
+        self.created_at = created_at
+    
+    @staticmethod
+    def from_row(row):
+        """Create Course object from database row"""
+        if row is None:
+            return None
+        return Course(
+            row['id'],
+            row['name'],
+            row['created_by'],
+            row['created_at']
+        )
+
+
+class TaskListItem:
+    """Checkin task with per-request status, for task list pages"""
+    __slots__ = ('id', 'title', 'code', 'start_time', 'end_time', 'course_name',
+                 'is_active', 'checkin_count', 'roster_size', 'has_checked_in')
+    
+    def __init__(self, task, is_active, course_name=None, checkin_count=None, roster_size=None,
+                 has_checked_in=None):
+        self.id = task.id
+        self.title = task.title
+        self.code = task.code
+        self.start_time = task.start_time
+        self.end_time = task.end_time
+        self.course_name = course_name
+        self.is_active = is_active
+        self.roster_size = roster_size
+        self.checkin_count = checkin_count
+        self.has_checked_in = has_checked_in
+
+
+class StudentCheckinStatus:
+    """A student's check-in status for one task, for roster pages"""
+    __slots__ = ('id', 'username', 'name', 'checked_in', 'checkin_time')
+    
+    def __init__(self, student, checkin_time):
+        self.id = student.id
+        self.username = student.username
+        self.name = student.name
+        self.checked_in = checkin_time is not None
+        self.checkin_time = checkin_time
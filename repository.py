@@ -0,0 +1,151 @@
+from database import get_db_connection, cached_load, TASK_CHECKIN_COUNT, TASK_ROSTER_SIZE
+from models import User, CheckinTask, Course, TaskListItem, StudentCheckinStatus, current_time
+
+
+# Queries here read plain cursor tuples (no sqlite3.Row) and build the
+# __slots__ models directly from them, one allocation per row.
+
+USER_COLUMNS = ', '.join(User.COLUMNS)
+TASK_COLUMNS = ', '.join(CheckinTask.COLUMNS)
+COURSE_COLUMNS = ', '.join(Course.COLUMNS)
+
+
+def _tuple_connection():
+    conn = get_db_connection()
+    conn.row_factory = None
+    return conn
+
+
+def load_students():
+    """Load all students ordered by username"""
+    def load(conn):
+        conn.row_factory = None
+        cursor = conn.execute(
+            f'SELECT {USER_COLUMNS} FROM users WHERE role = ? ORDER BY username',
+            ('student',)
+        )
+        return [User(*values) for values in cursor]
+    return cached_load('users', ('repository.load_students',), load)
+
+
+def load_tasks():
+    """Load all checkin tasks, newest first"""
+    def load(conn):
+        conn.row_factory = None
+        cursor = conn.execute(f'SELECT {TASK_COLUMNS} FROM checkin_tasks ORDER BY created_at DESC')
+        return [CheckinTask(*values) for values in cursor]
+    return cached_load('tasks', ('repository.load_tasks',), load)
+
+
+def load_courses():
+    """Load all courses ordered by name"""
+    def load(conn):
+        conn.row_factory = None
+        cursor = conn.execute(f'SELECT {COURSE_COLUMNS} FROM courses ORDER BY name')
+        return [Course(*values) for values in cursor]
+    return cached_load('courses', ('repository.load_courses',), load)
+
+
+def load_course_students(course_id):
+    """Load the students enrolled in a course ordered by username"""
+    columns = ', '.join(f'u.{column}' for column in User.COLUMNS)
+
+    def load(conn):
+        conn.row_factory = None
+        cursor = conn.execute(f'''
+            SELECT {columns}
+            FROM course_enrollments e
+            JOIN users u ON u.id = e.user_id
+            WHERE e.course_id = ?
+            ORDER BY u.username
+        ''', (course_id,))
+        return [User(*values) for values in cursor]
+    return cached_load(('courses', 'users'), ('repository.load_course_students', course_id), load)
+
+
+def load_roster(course_id):
+    """Students expected to check in for a task of course_id (None: all students)"""
+    if course_id is None:
+        return load_students()
+    return load_course_students(course_id)
+
+
+def load_user_course_ids(user_id):
+    """Load the ids of the courses a student is enrolled in"""
+    conn = _tuple_connection()
+    course_ids = {row[0] for row in conn.execute(
+        'SELECT course_id FROM course_enrollments WHERE user_id = ?', (user_id,)
+    )}
+    conn.close()
+    return course_ids
+
+
+def load_checkin_times(user_id):
+    """Load all of one user's check-ins. Returns a dict of task_id -> checkin_time"""
+    conn = _tuple_connection()
+    times = dict(conn.execute(
+        'SELECT task_id, checkin_time FROM checkin_records WHERE user_id = ?',
+        (user_id,)
+    ))
+    conn.close()
+    return times
+
+
+def load_task_counts():
+    """Load the check-in count and roster size of every task, frozen for
+    closed tasks. Returns a dict of task_id -> (checkin_count, roster_size)"""
+    conn = _tuple_connection()
+    counts = {row[0]: (row[1], row[2]) for row in conn.execute(f'''
+        SELECT t.id, {TASK_CHECKIN_COUNT}, {TASK_ROSTER_SIZE}
+        FROM checkin_tasks t
+        LEFT JOIN task_summaries s ON s.task_id = t.id
+    ''')}
+    conn.close()
+    return counts
+
+
+def load_task_checkin_times(task_id):
+    """Load all check-ins for one task. Returns a dict of user_id -> checkin_time"""
+    conn = _tuple_connection()
+    times = dict(conn.execute(
+        'SELECT user_id, checkin_time FROM checkin_records WHERE task_id = ?',
+        (task_id,)
+    ))
+    conn.close()
+    return times
+
+
+def load_admin_task_list():
+    """Tasks with check-in counts, roster sizes and active flags for the admin dashboard"""
+    tasks = load_tasks()
+    counts = load_task_counts()
+    course_names = {course.id: course.name for course in load_courses()}
+    now = current_time()
+    task_list = []
+    for task in tasks:
+        checkin_count, roster_size = counts.get(task.id, (0, 0))
+        task_list.append(TaskListItem(
+            task, task.is_active(now),
+            course_name=course_names.get(task.course_id),
+            checkin_count=checkin_count,
+            roster_size=roster_size
+        ))
+    return task_list
+
+
+def load_student_task_list(user_id):
+    """The student's tasks (open tasks and those of enrolled courses) with check-in status"""
+    course_ids = load_user_course_ids(user_id)
+    tasks = [task for task in load_tasks() if task.course_id is None or task.course_id in course_ids]
+    course_names = {course.id: course.name for course in load_courses()}
+    checked_in = load_checkin_times(user_id)
+    now = current_time()
+    return [TaskListItem(task, task.is_active(now), course_name=course_names.get(task.course_id),
+                         has_checked_in=task.id in checked_in) for task in tasks]
+
+
+def load_roster_status(task_id, course_id=None):
+    """Check-in status for one task of every student on its roster, ordered by username"""
+    times = load_task_checkin_times(task_id)
+    students = load_roster(course_id)
+    return [StudentCheckinStatus(student, times.get(student.id)) for student in students]
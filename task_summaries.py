@@ -0,0 +1,162 @@
+import csv
+import heapq
+import io
+import json
+import threading
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+from analytics import LATENCY_BINS, latency_labels
+from database import get_task_summary, save_task_summary, get_unsummarized_tasks, get_pending_task_end_times
+from models import current_time
+from repository import load_roster_status
+
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def roster_csv(student_status):
+    """Render a task roster as the CSV offered for download"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['学号', '姓名', '签到状态', '签到时间'])
+    for student in student_status:
+        status = '已签到' if student.checked_in else '未签到'
+        writer.writerow([student.username, student.name, status, student.checkin_time or ''])
+    return output.getvalue()
+
+
+def _latency_minutes(start_time, checkin_time):
+    # checkin_time is stored in UTC, task times in local time
+    checked_in = datetime.strptime(checkin_time, TIME_FORMAT).replace(tzinfo=timezone.utc).astimezone()
+    return (checked_in.replace(tzinfo=None) - datetime.strptime(start_time, TIME_FORMAT)).total_seconds() / 60
+
+
+def compute_task_summary(task):
+    """Summarize a task from its live check-in records"""
+    student_status = load_roster_status(task['id'], task['course_id'])
+    counts = [0] * (len(LATENCY_BINS) - 1)
+    absent = []
+    for student in student_status:
+        if student.checked_in:
+            # Clamp clock skew so that early check-ins fall in the first bin
+            minutes = max(_latency_minutes(task['start_time'], student.checkin_time), 0)
+            counts[bisect_right(LATENCY_BINS, minutes) - 1] += 1
+        else:
+            absent.append({'id': student.id, 'username': student.username, 'name': student.name})
+    return {
+        'task_id': task['id'],
+        'roster_size': len(student_status),
+        'checkin_count': len(student_status) - len(absent),
+        'absent_students': absent,
+        'latency_histogram': {'labels': latency_labels(), 'counts': counts},
+        'csv_content': roster_csv(student_status)
+    }
+
+
+def load_task_summary(task):
+    """Summary of a task: the frozen copy once it has closed, computed live otherwise"""
+    row = get_task_summary(task['id'])
+    if row is None:
+        return compute_task_summary(task)
+    return {
+        'task_id': row['task_id'],
+        'roster_size': row['roster_size'],
+        'checkin_count': row['checkin_count'],
+        'absent_students': json.loads(row['absent_students']),
+        'latency_histogram': json.loads(row['latency_histogram']),
+        'csv_content': row['csv_content']
+    }
+
+
+def freeze_task(task):
+    """Compute and store the summary of a closed task.
+    Returns False if it had already been stored"""
+    summary = compute_task_summary(task)
+    return save_task_summary(
+        task['id'],
+        summary['roster_size'],
+        summary['checkin_count'],
+        json.dumps(summary['absent_students'], ensure_ascii=False),
+        json.dumps(summary['latency_histogram'], ensure_ascii=False),
+        summary['csv_content']
+    )
+
+
+def freeze_closed_tasks(delay=0):
+    """Freeze every task that ended more than delay seconds ago and has no
+    summary yet. Returns the number of summaries stored"""
+    cutoff = (datetime.now() - timedelta(seconds=delay)).strftime(TIME_FORMAT)
+    return sum(1 for task in get_unsummarized_tasks(cutoff) if freeze_task(task))
+
+
+class TaskSummaryScheduler:
+    """Background thread that freezes task summaries as task windows close.
+
+    The thread sleeps until the earliest known end_time plus a grace delay
+    (for check-ins accepted in the last second), but at most poll_interval
+    seconds so that tasks created by other worker processes are picked up
+    too. Its first pass catches up on tasks that closed while the app was
+    down. Storing a summary is idempotent, so several processes may run a
+    scheduler against the same database.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._end_times = []
+        self._thread = None
+        self.delay = 5
+        self.poll_interval = 60
+
+    def start(self, delay=5, poll_interval=60):
+        """Start the background thread (once per process)"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self.delay = delay
+            self.poll_interval = poll_interval
+            self._end_times = get_pending_task_end_times(current_time())
+            heapq.heapify(self._end_times)
+            self._thread = threading.Thread(target=self._run, name='task-summaries', daemon=True)
+            self._thread.start()
+
+    def schedule(self, end_time):
+        """Wake up when a newly created task ends"""
+        with self._cond:
+            if self._thread is None:
+                return
+            heapq.heappush(self._end_times, end_time)
+            self._cond.notify()
+
+    def _next_timeout(self):
+        if not self._end_times:
+            return self.poll_interval
+        due = datetime.strptime(self._end_times[0], TIME_FORMAT) + timedelta(seconds=self.delay + 1)
+        return min(max((due - datetime.now()).total_seconds(), 0), self.poll_interval)
+
+    def _run(self):
+        while True:
+            try:
+                freeze_closed_tasks(self.delay)
+            except Exception as e:
+                print(f'Task summary scheduler error: {e}')
+            with self._cond:
+                self._cond.wait(self._next_timeout())
+                cutoff = (datetime.now() - timedelta(seconds=self.delay)).strftime(TIME_FORMAT)
+                while self._end_times and self._end_times[0] < cutoff:
+                    heapq.heappop(self._end_times)
+
+
+# Shared per-process scheduler
+summary_scheduler = TaskSummaryScheduler()
+
+
+def init_app(app):
+    """Start the scheduler (unless disabled) and register the catch-up command"""
+    if app.config['TASK_SUMMARY_SCHEDULER']:
+        summary_scheduler.start(app.config['TASK_SUMMARY_DELAY'], app.config['TASK_SUMMARY_POLL_INTERVAL'])
+
+    @app.cli.command('freeze-task-summaries')
+    def freeze_task_summaries_command():
+        """Store summaries for all closed tasks that lack one"""
+        print(f'{freeze_closed_tasks(app.config["TASK_SUMMARY_DELAY"])} task summaries stored')